@@ -1,7 +1,19 @@
+import itertools
 import os
+import random
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import time
+from storage import ROTA_FIELDS, start_hour
+from metrics import (
+    airtable_requests,
+    airtable_request_seconds,
+    airtable_retries,
+    airtable_retry_sleep_seconds,
+    airtable_rate_limit_sleep_seconds
+)
 
 load_dotenv()
 airtable_key = os.getenv('AIRTABLE_KEY')
@@ -11,20 +23,123 @@ tasks_tbl_url = 'https://api.airtable.com/v0/appLwrU5u2KrHXkAd/Tasks'
 unavailability_tbl_url = 'https://api.airtable.com/v0/appLwrU5u2KrHXkAd/Unavailability'
 rota_tbl_url = 'https://api.airtable.com/v0/appLwrU5u2KrHXkAd/Rota'
 
+# Airtable allows 5 requests per second per base
+airtable_rate_limit = float(os.getenv('AIRTABLE_RATE_LIMIT', '5'))
+
+
+# Token bucket shared by every thread that talks to Airtable
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Block until a request may be sent
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            airtable_rate_limit_sleep_seconds.inc(wait)
+            time.sleep(wait)
+
+
+# Airtable client holding a pooled keep-alive session and the shared rate limiter
+class AirtableClient:
+    def __init__(self, api_key, rate=5, max_retries=5, backoff=0.5, timeout=30, pool_size=10):
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': f'Bearer {api_key}'})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.limiter = RateLimiter(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    # Send a request, retrying rate limited (429) and server error (5xx) responses with backoff
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        table, operation = request_labels(method, url)
+        with airtable_request_seconds.time(table=table, operation=operation):
+            attempt = 0
+            while True:
+                self.limiter.acquire()
+                response = self.session.request(method, url, **kwargs)
+                airtable_requests.inc(table=table, operation=operation, status=response.status_code)
+                retryable = response.status_code == 429 or response.status_code >= 500
+                if not retryable or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+                delay = self.retry_delay(response, attempt)
+                airtable_retries.inc(table=table, operation=operation, status=response.status_code)
+                airtable_retry_sleep_seconds.inc(delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def retry_delay(self, response, attempt):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Exponential backoff with jitter, capped at the 30 seconds Airtable asks for after a 429
+        return min(30, self.backoff * 2 ** attempt) * (1 + random.random() / 2)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    # Yield every record matching the listRecords query, fetching one page at a time
+    def iter_records(self, url, data=None):
+        data = dict(data or {})
+        while True:
+            page = self.post(url + '/listRecords', json=data).json()
+            yield from page.get('records', [])
+
+            offset = page.get('offset')
+            if not offset:
+                break
+            data['offset'] = offset
+
+    def list_records(self, url, data=None):
+        return list(self.iter_records(url, data))
+
+
+# Table name and operation of a request to a table URL, used to label its metrics
+def request_labels(method, url):
+    parts = url.rstrip('/').split('/')
+    if parts[-1] == 'listRecords':
+        return parts[-2], 'list'
+    operations = {'GET': 'list', 'POST': 'create', 'PATCH': 'update', 'DELETE': 'delete'}
+    return parts[-1].split('?')[0], operations.get(method, method.lower())
+
+
+client = AirtableClient(airtable_key, rate=airtable_rate_limit)
+
 # Get Employee data
 def get_employee_data():
-    # Get all employee data from Airtable
-    # ToDo: Add pagination
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
-    response = requests.get(employee_tbl_url, headers=headers)
-    response.raise_for_status()
-    
+    # Get all employee data from Airtable making multiple calls to Airtable if required
+    records = client.iter_records(employee_tbl_url)
+
     # Create a dict from the response with the employee id as the key
     employee_data = {}
-    for employee in response.json()['records']:
+    for employee in records:
         employee_data[employee['fields']['EmployeeId']] = {
             'Name': employee['fields']['Name'],
             'DefaultFloor': employee['fields']['DefaultFloor'],
@@ -34,17 +149,12 @@ def get_employee_data():
 
 # Get Floor data
 def get_floor_data():
-    # Get floor data from airtable
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
-    response = requests.get(floors_tbl_url, headers=headers)
-    response.raise_for_status()
-    
+    # Get floor data from airtable making multiple calls to Airtable if required
+    records = client.iter_records(floors_tbl_url)
+
     # Create a dict from the response with the floor name as the key
     floor_data = {}
-    for floor in response.json()['records']:
+    for floor in records:
         floor_data[floor['fields']['Floor']] = {
             'Tasks List': floor['fields']['Tasks List'],
             'Total Employees Required': floor['fields']['Total Employees Required']
@@ -53,17 +163,12 @@ def get_floor_data():
 
 # Get Task data
 def get_task_data():
-    # Get task data from airtable
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
-    response = requests.get(tasks_tbl_url, headers=headers)
-    response.raise_for_status()
-    
+    # Get task data from airtable making multiple calls to Airtable if required
+    records = client.iter_records(tasks_tbl_url)
+
     # Create a dict from the response with the task name as the key
     task_data = {}
-    for task in response.json()['records']:
+    for task in records:
         task_data[task['fields']['Task']] = {
             'Employees Required': task['fields']['Employees Required']
         }
@@ -71,142 +176,105 @@ def get_task_data():
 
 # Get Unavailability info for a specific data
 def get_unavailability_data(date):
-    # Get Unavailability data from airtable
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
     # Only return rows for which the date is on or between the start and end dates
     data = {
         'filterByFormula': f"OR(IS_SAME('{date}', {{Holiday Start Date}}, 'day'), AND(IS_AFTER('{date}', {{Holiday Start Date}}), IS_BEFORE('{date}', {{Holiday End Date}})), IS_SAME('{date}', {{Holiday End Date}}, 'day'))"
     }
-    response = requests.post(unavailability_tbl_url + '/listRecords', headers=headers, json=data)
-    response.raise_for_status()
+    records = client.list_records(unavailability_tbl_url, data)
 
-    # Create a dict from the response with the floor name as the key
+    # Create a dict from the response with the employee id as the key, an employee
+    # can have several overlapping holiday records so each maps to a list of periods
     unavailability_data = {}
-    for unavailability in response.json()['records']:
-        unavailability_data[unavailability['fields']['Employee ID']] = {
+    for unavailability in records:
+        unavailability_data.setdefault(unavailability['fields']['Employee ID'], []).append({
             'Start Date': unavailability['fields']['Holiday Start Date'],
             'End Date': unavailability['fields']['Holiday End Date']
-        }
+        })
     return unavailability_data
 
-# Add time off to Unavailability table
-def add_time_off(employee_id, start_date, end_date):
-    # Get Unavailability data from airtable
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
+# Get every Unavailability record that overlaps the start and end dates
+def get_unavailability_for_range(start_date, end_date):
+    # Only return rows for which the holiday starts on or before the end date and ends on or after the start date
     data = {
-        "records": [
-            {
-            "fields": {
-                "Employee ID": employee_id,
-                "Holiday Start Date": start_date,
-                "Holiday End Date": end_date
-            }
-            }
-        ]
+        'filterByFormula': f"AND(NOT(IS_AFTER({{Holiday Start Date}}, '{end_date}')), NOT(IS_BEFORE({{Holiday End Date}}, '{start_date}')))"
     }
-    response = requests.post(unavailability_tbl_url, headers=headers, json=data)
-    response.raise_for_status()
+    records = client.list_records(unavailability_tbl_url, data)
 
+    # Create a list of holiday periods, one per record
+    periods = []
+    for unavailability in records:
+        periods.append({
+            'Employee ID': unavailability['fields']['Employee ID'],
+            'Start Date': unavailability['fields']['Holiday Start Date'],
+            'End Date': unavailability['fields']['Holiday End Date']
+        })
+    return periods
 
-def get_rota_for_day(date):
-    # Get rota data from airtable
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
-    # Only return rows for which the date is the same as the input date
-    data = {
-        'filterByFormula': f"IS_SAME('{date}', {{Date}}, 'day')"
-    }
+# Add time off to Unavailability table
+def add_time_off(employee_id, start_date, end_date):
+    add_time_off_bulk([(employee_id, start_date, end_date)])
 
-    # Get all records from the table making multiple calls to Airtable if required
-    records = []
-    run = True
-    while run:
-        response = requests.post(rota_tbl_url + '/listRecords', headers=headers, json=data)
-        response.raise_for_status()
-        records.extend(response.json().get('records', []))
+# Add (employee id, start date, end date) periods of time off to Unavailability table, at most 10 per call
+def add_time_off_bulk(periods):
+    for i in range(0, len(periods), 10):
+        data = {
+            "records": [
+                {
+                "fields": {
+                    "Employee ID": employee_id,
+                    "Holiday Start Date": start_date,
+                    "Holiday End Date": end_date
+                }
+                }
+                for employee_id, start_date, end_date in periods[i:i + 10]
+            ]
+        }
+        client.post(unavailability_tbl_url, json=data)
 
-        offset = response.json().get('offset')
-        if offset:
-            data['offset'] = offset
-        else:
-            run = False
-
-    # Create a list of records for the day's rota
-    rota = []
-    for record in records:
-        rota.append([
-            record['fields']['Date'],
-            record['fields']['Employee ID'],
-            record['fields']['Employee Name'],
-            record['fields']['Start Time'],
-            record['fields']['End Time'],
-            record['fields']['Floor'],
-            record['fields']['Task']
-        ])
-    return rota
-
-def get_rota_for_employee_and_day(date, employee_id):
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
-    # Only return rows for which the date is the same as the input date and the
-    # EmployeeID matches the input id
-    data = {
-        'filterByFormula': f"AND(IS_SAME('{date}', {{Date}}, 'day'), {employee_id}={{Employee ID}})"
-    }
-    response = requests.post(rota_tbl_url + '/listRecords', headers=headers, json=data)
-    response.raise_for_status()
-
-    # Create a list of records for the day's rota
-    rota = []
-    for record in response.json()['records']:
-        rota.append([
-            record['fields']['Date'],
-            record['fields']['Employee ID'],
-            record['fields']['Employee Name'],
-            record['fields']['Start Time'],
-            record['fields']['End Time'],
-            record['fields']['Floor'],
-            record['fields']['Task']
-        ])
-    return rota
 
 def get_dates_w_rota_in_range(start_date, end_date):
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
-    # Only return rows for which the date is on or between the start and end dates
+    # Only return rows for which the date is on or between the start and end dates,
+    # reading just the Date field of every page
     data = {
-        'filterByFormula': f"OR(IS_SAME('{start_date}', {{Date}}, 'day'), AND(IS_AFTER({{Date}}, '{start_date}'), IS_BEFORE({{Date}}, '{end_date}')), IS_SAME('{end_date}', {{Date}}, 'day'))"
+        'filterByFormula': rota_date_range_formula(start_date, end_date),
+        'fields': ['Date']
     }
-    response = requests.post(rota_tbl_url + '/listRecords', headers=headers, json=data)
-    response.raise_for_status()
 
     # Create a set with the unique dates in the response
-    records = response.json().get('records', [])
-    dates = {record['fields']['Date'] for record in records}
+    dates = {record['fields']['Date'] for record in client.iter_records(rota_tbl_url, data)}
     return dates
 
-def get_all_rota_record_ids():
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
+# Yield the rota rows between the start and end dates in date, floor, employee and time order,
+# optionally only for one employee or floor. Pages are requested from Airtable as the rows are consumed
+def iter_rota_in_range(start_date, end_date, employee_id=None, floor=None):
+    conditions = [rota_date_range_formula(start_date, end_date)]
+    if employee_id is not None:
+        conditions.append(f"{int(employee_id)}={{Employee ID}}")
+    if floor is not None:
+        escaped_floor = floor.replace('\\', '\\\\').replace("'", "\\'")
+        conditions.append(f"{{Floor}}='{escaped_floor}'")
+    data = {
+        'filterByFormula': f"AND({', '.join(conditions)})",
+        'sort': [
+            {'field': 'Date', 'direction': 'asc'},
+            {'field': 'Floor', 'direction': 'asc'},
+            {'field': 'Employee ID', 'direction': 'asc'}
+        ]
     }
+    # Start Time is text that Airtable sorts with 10:00 before 9:00, so each employee's day is
+    # put in time order here
+    rows = ({field: record['fields'].get(field) for field in ROTA_FIELDS} for record in client.iter_records(rota_tbl_url, data))
+    for _, employee_day in itertools.groupby(rows, key=lambda row: (row['Date'], row['Floor'], row['Employee ID'])):
+        yield from sorted(employee_day, key=start_hour)
+
+def rota_date_range_formula(start_date, end_date):
+    return f"OR(IS_SAME('{start_date}', {{Date}}, 'day'), AND(IS_AFTER({{Date}}, '{start_date}'), IS_BEFORE({{Date}}, '{end_date}')), IS_SAME('{end_date}', {{Date}}, 'day'))"
+
+def get_all_rota_record_ids():
     record_ids = []
     params = {}
     while True:
-        response = requests.get(rota_tbl_url, headers=headers, params=params)
-        response.raise_for_status()
+        response = client.get(rota_tbl_url, params=params)
 
         data = response.json()
         records = data.get('records', [])
@@ -216,55 +284,37 @@ def get_all_rota_record_ids():
         if not offset:
             break
         params['offset'] = offset
-        time.sleep(0.25) # Handle rate limit of 5 requests per second + buffer
     return record_ids
 
-def get_rota_record_ids_for_day(date):
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
-    record_ids = []
+def get_rota_records_for_day(date):
+    # Get the stored rota records for the day including their record ids
     params = {
         'filterByFormula': f"IS_SAME('{date}', {{Date}}, 'day')"
     }
-    while True:
-        response = requests.post(rota_tbl_url + '/listRecords', headers=headers, json=params)
-        response.raise_for_status()
-
-        data = response.json()
-        records = data.get('records', [])
-        record_ids.extend([record['id'] for record in records])
-
-        offset = data.get('offset')
-        if not offset:
-            break
-        params['offset'] = offset
-        time.sleep(0.25) # Handle rate limit of 5 requests per second + buffer
-    return record_ids
+    return client.list_records(rota_tbl_url, params)
 
 def delete_rota_records(record_ids):
-    headers = {
-        'Authorization': f'Bearer {airtable_key}'
-    }
+    # Airtable deletes at most 10 records per call, the client paces the batches to the rate limit
     for i in range(0, len(record_ids), 10):
         batch = record_ids[i:i + 10]
-        query = "&".join([f"records[]={record_id}" for record_id in batch])
-        url = f"{rota_tbl_url}?{query}"
-        response = requests.delete(url, headers=headers)
-        response.raise_for_status()
-        time.sleep(0.25) # Handle rate limit of 5 requests per second + buffer
+        client.delete(rota_tbl_url, params={'records[]': batch})
 
 def write_to_rota_table(records):
-    # Write records to airtable
-    headers = {
-        'Authorization': f'Bearer {airtable_key}',
-        'Content-Type': 'application/json'
-    }
+    # Write records to airtable, at most 10 per call, and return the created records with their ids
+    created = []
+    for i in range(0, len(records), 10):
+        batch = records[i:i + 10]
+        data = {'records': batch}
+        response = client.post(rota_tbl_url, json=data)
+        created.extend(response.json().get('records', []))
+    return created
 
+def update_rota_records(records):
+    # Update records in place, each record holds the record id and the fields to set, at most 10 per call
+    updated = []
     for i in range(0, len(records), 10):
         batch = records[i:i + 10]
         data = {'records': batch}
-        response = requests.post(rota_tbl_url, headers=headers, json=data)
-        response.raise_for_status()
-        time.sleep(0.25) # Handle rate limit of 5 requests per second + buffer
+        response = client.patch(rota_tbl_url, json=data)
+        updated.extend(response.json().get('records', []))
+    return updated
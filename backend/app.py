@@ -1,25 +1,41 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
+import csv
 import datetime
+import io
+import json
+import os
 
-from airtable import (
-    add_time_off,
-    get_employee_data,
-    get_floor_data,
-    get_task_data,
-    get_rota_for_day,
-    get_rota_for_employee_and_day,
-    get_dates_w_rota_in_range,
-    get_rota_record_ids_for_day,
-    delete_rota_records,
-    write_to_rota_table
-)
+from storage import storage, ROTA_FIELDS
 from scheduler import (
     gen_rota_for_date_range,
-    gen_rota_for_date
+    gen_rota_for_floor,
+    regen_rota_for_floor,
+    print_unsolved_floor
 )
+from unavailability import load_unavailability_index
+from persistence import save_rota_for_day
+from refdata import reference_data
+from jobs import rota_jobs, QueueFullError
+from solver_config import default_solver_settings
+from rota_cache import rota_cache
+from rota_table import iter_records
+from solver_service import interactive_solver_service
+from metrics import registry, record_floor_solve
 
 app = Flask(__name__)
 
+# Default number of solver processes used by /rota/generate, can be overridden per request
+rota_workers = int(os.getenv('ROTA_WORKERS', '1'))
+# Most solver processes a request may ask for, each one loads OR-Tools
+rota_max_workers = int(os.getenv('ROTA_MAX_WORKERS', str(os.cpu_count() or 1)))
+
+
+# A floor could not be re-solved after time-off was added, its stored rota is left as it was
+class UnsolvedFloorError(Exception):
+    def __init__(self, stats):
+        super().__init__(f'No rota for {stats.floor} on {stats.date}: {stats.status}')
+        self.stats = stats
+
 # Home endpoint
 @app.route('/')
 def home():
@@ -39,20 +55,63 @@ def generate_rota_for_dates():
             'error': 'Missing fields in request data.',
             'missing_fields': missing_keys
         }), 400)
-    
+
+    if not (is_valid_date(data['StartDate']) and is_valid_date(data['EndDate'])):
+        return make_response(jsonify({
+            'error': 'Invalid date, please provide valid dates in YYYY-MM-DD format.'
+        }), 400)
+
     try:
-        # Fetch required data
-        employee_data = get_employee_data()
-        floor_data = get_floor_data()
-        task_data = get_task_data()
+        settings = default_solver_settings.with_overrides(data.get('Solver', {}))
+    except (ValueError, TypeError, AttributeError) as e:
+        return make_response(jsonify({
+            'error': f'Invalid solver settings: {e}'
+        }), 400)
 
-        # Generate Rota
-        gen_rota_for_date_range(data['StartDate'], data['EndDate'], employee_data, task_data, floor_data)
-    except:
+    workers = data.get('Workers', rota_workers)
+    if isinstance(workers, str) and workers.isdigit():
+        workers = int(workers)
+    if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
         return make_response(jsonify({
-            'error': 'Failed to generate rota for the date range.'
-        }), 500)
-    return "Successfully generated rota for the date range.\n"
+            'error': 'Invalid Workers, please provide a positive integer.'
+        }), 400)
+    if workers > rota_max_workers:
+        return make_response(jsonify({
+            'error': f'Invalid Workers, at most {rota_max_workers} solver processes can be used.'
+        }), 400)
+
+    # Generation runs as a background job, the response only carries the job id to poll
+    try:
+        job = rota_jobs.submit(
+            f"Generate rota from {data['StartDate']} to {data['EndDate']}",
+            run_rota_generation, data['StartDate'], data['EndDate'], workers, settings
+        )
+    except QueueFullError:
+        return make_response(jsonify({
+            'error': 'Too many rota generation jobs are queued, please try again later.'
+        }), 503)
+    response = make_response(jsonify({'JobID': job.id, 'Status': job.status}), 202)
+    response.headers['Location'] = f'/rota/jobs/{job.id}'
+    return response
+
+def run_rota_generation(start_date, end_date, workers, settings, progress=None):
+    # Fetch required data
+    employee_data = reference_data.get('employees')
+    floor_data = reference_data.get('floors')
+    task_data = reference_data.get('tasks')
+
+    # Generate Rota
+    gen_rota_for_date_range(start_date, end_date, employee_data, task_data, floor_data, workers, progress, settings)
+
+# Poll the progress of a rota generation job
+@app.route('/rota/jobs/<string:job_id>')
+def get_rota_job(job_id):
+    job = rota_jobs.get(job_id)
+    if job is None:
+        return make_response(jsonify({
+            'error': 'Unknown job id.'
+        }), 404)
+    return jsonify(job.to_dict())
 
 # Fetch rota
 @app.route('/rota/fetch/<string:date>')
@@ -63,20 +122,63 @@ def fetch_rota_for_day(date):
             'error': 'Invalid date, please provide a valid date in YYYY-MM-DD format.'
         }), 400)
     try:
+        # Served from the read cache, the employee's rows are already in time order
         employee_id = request.args.get('EmployeeID')
         if not employee_id:
-            rota = get_rota_for_day(date)
-            
+            rota = rota_cache.get_rota_for_day(date)
         else:
-            rota = get_rota_for_employee_and_day(date, employee_id)
-            #adding ascending sort for schedule formatting, based on End time "[4]"
-            rota = sorted(rota, key=lambda x: x[4])
+            rota = rota_cache.get_rota_for_employee_and_day(date, employee_id)
     except:
         return make_response(jsonify({
             'error': 'Failed to fetch the rota for the day.'
         }), 500)
     return rota
 
+# Export the rota for a date range as NDJSON or CSV, streamed while the stored rota is paged through
+@app.route('/rota/export')
+def export_rota():
+    start_date = request.args.get('StartDate')
+    end_date = request.args.get('EndDate')
+    if not (start_date and end_date and is_valid_date(start_date) and is_valid_date(end_date)):
+        return make_response(jsonify({
+            'error': 'Invalid date, please provide valid StartDate and EndDate in YYYY-MM-DD format.'
+        }), 400)
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return make_response(jsonify({
+            'error': 'Invalid format, please use ndjson or csv.'
+        }), 400)
+
+    employee_id = request.args.get('EmployeeID')
+    if employee_id is not None and not employee_id.isdigit():
+        return make_response(jsonify({
+            'error': 'Invalid EmployeeID, please provide a number.'
+        }), 400)
+
+    rows = storage.iter_rota_in_range(start_date, end_date, employee_id, request.args.get('Floor'))
+    if export_format == 'csv':
+        body = csv_lines(rows)
+        mimetype = 'text/csv'
+    else:
+        body = (json.dumps(row) + '\n' for row in rows)
+        mimetype = 'application/x-ndjson'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=rota_{start_date}_{end_date}.{export_format}'
+    return response
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=ROTA_FIELDS)
+    # The header goes out on its own so an export without rows still has one
+    writer.writeheader()
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow(row)
+        yield buffer.getvalue()
+
 # Request timeoff
 @app.route('/timeoff/add', methods=['POST'])
 def request_time_off():
@@ -96,27 +198,44 @@ def request_time_off():
         return make_response(jsonify({
             'error': 'Invalid date, please provide valid dates in YYYY-MM-DD format.'
         }), 400)
+
+    # Employee ids are integers in the Employee table, "7" must find employee 7
+    employee_id = parse_employee_id(data['EmployeeID'])
+    if employee_id is None:
+        return make_response(jsonify({
+            'error': 'Invalid EmployeeID, please provide a number.'
+        }), 400)
+    data['EmployeeID'] = employee_id
+
+    try:
+        settings = default_solver_settings.with_overrides(data.get('Solver', {}))
+    except (ValueError, TypeError, AttributeError) as e:
+        return make_response(jsonify({
+            'error': f'Invalid solver settings: {e}'
+        }), 400)
+
     try:
         print(f"---------Adding time-off for EmployeeID: {data['EmployeeID']} from {data['StartDate']} to {data['EndDate']}------------------")
-        add_time_off(data['EmployeeID'], data['StartDate'], data['EndDate'])
-        dates = get_dates_w_rota_in_range(data['StartDate'], data['EndDate'])
+        storage.add_time_off(data['EmployeeID'], data['StartDate'], data['EndDate'])
+        dates = storage.get_dates_w_rota_in_range(data['StartDate'], data['EndDate'])
     except:
         return make_response(jsonify({
             'error': 'Failed to add time-off.'
         }), 500)
+
+    date = None
     try:
-        employee_data = get_employee_data()
-        floor_data = get_floor_data()
-        task_data = get_task_data()
-        for date in dates:
-            print(f'---------Generating Rota for {date}------------------')
-            records = gen_rota_for_date(date, employee_data, task_data, floor_data)
-            print(f'---------Deleting existing Rota records if any for {date}------------------')
-            record_ids = get_rota_record_ids_for_day(date)
-            delete_rota_records(record_ids)
-            print(f'---------Writing new Rota records for {date}------------------')
-            write_to_rota_table(records)
-            print(f'---------Generating Rota for {date} complete------------------')
+        employee_data = reference_data.get('employees')
+        floor_data = reference_data.get('floors')
+        task_data = reference_data.get('tasks')
+        affected = affected_floors([(data['EmployeeID'], data['StartDate'], data['EndDate'])], dates,
+                                   employee_data, floor_data)
+        if affected:
+            unavailability = load_unavailability_index(min(affected), max(affected))
+        for date in sorted(affected):
+            regenerate_day_for_time_off(date, affected[date], employee_data, task_data, floor_data, unavailability, settings)
+    except UnsolvedFloorError as e:
+        return unsolved_floor_response(e.stats)
     except:
         return make_response(jsonify({
             'error': f'Failed to generate rota with time-off for {date}.'
@@ -124,6 +243,156 @@ def request_time_off():
 
     return "Added time-off.\n"
 
+# Request timeoff for several employees or periods at once. Every affected floor and day is re-solved once
+@app.route('/timeoff/add/bulk', methods=['POST'])
+def request_bulk_time_off():
+    data = request.json
+
+    if not isinstance(data.get('TimeOff'), list) or not data['TimeOff']:
+        return make_response(jsonify({
+            'error': 'TimeOff must be a non-empty list of time-off requests.'
+        }), 400)
+
+    # List of required fields of every time-off request
+    required_keys = ['EmployeeID', 'StartDate', 'EndDate']
+
+    for i, entry in enumerate(data['TimeOff']):
+        if not isinstance(entry, dict) or not all(key in entry for key in required_keys):
+            missing_keys = [key for key in required_keys if not isinstance(entry, dict) or key not in entry]
+            return make_response(jsonify({
+                'error': f'Missing fields in time-off request {i}.',
+                'missing_fields': missing_keys
+            }), 400)
+        if not (is_valid_date(entry['StartDate']) and is_valid_date(entry['EndDate'])):
+            return make_response(jsonify({
+                'error': f'Invalid date in time-off request {i}, please provide valid dates in YYYY-MM-DD format.'
+            }), 400)
+        if parse_employee_id(entry['EmployeeID']) is None:
+            return make_response(jsonify({
+                'error': f'Invalid EmployeeID in time-off request {i}, please provide a number.'
+            }), 400)
+
+    try:
+        settings = default_solver_settings.with_overrides(data.get('Solver', {}))
+    except (ValueError, TypeError, AttributeError) as e:
+        return make_response(jsonify({
+            'error': f'Invalid solver settings: {e}'
+        }), 400)
+
+    periods = [(parse_employee_id(entry['EmployeeID']), entry['StartDate'], entry['EndDate']) for entry in data['TimeOff']]
+    try:
+        print(f'---------Adding {len(periods)} time-off requests------------------')
+        storage.add_time_off_bulk(periods)
+        dates = storage.get_dates_w_rota_in_range(min(start for _, start, _ in periods), max(end for _, _, end in periods))
+    except:
+        return make_response(jsonify({
+            'error': 'Failed to add time-off.'
+        }), 500)
+
+    date = None
+    try:
+        employee_data = reference_data.get('employees')
+        floor_data = reference_data.get('floors')
+        task_data = reference_data.get('tasks')
+        affected = affected_floors(periods, dates, employee_data, floor_data)
+        if affected:
+            unavailability = load_unavailability_index(min(affected), max(affected))
+        for date in sorted(affected):
+            regenerate_day_for_time_off(date, affected[date], employee_data, task_data, floor_data, unavailability, settings)
+    except UnsolvedFloorError as e:
+        return unsolved_floor_response(e.stats)
+    except:
+        return make_response(jsonify({
+            'error': f'Failed to generate rota with time-off for {date}.'
+        }), 500)
+
+    return f"Added {len(periods)} time-off requests, regenerated {len(affected)} days.\n"
+
+# Map every date with a rota that the time-off periods touch to the set of floors to re-solve.
+# An absence only affects the employee's own floor, unknown employees or floors map the date
+# to None so every floor of the day is regenerated
+def affected_floors(periods, dates, employee_data, floor_data):
+    affected = {}
+    for employee_id, start_date, end_date in periods:
+        employee = employee_data.get(employee_id)
+        floor = employee['DefaultFloor'] if employee and employee['DefaultFloor'] in floor_data else None
+        for date in dates:
+            if not start_date <= date <= end_date:
+                continue
+            floors = affected.setdefault(date, set())
+            if floor is None:
+                affected[date] = None
+            elif floors is not None:
+                floors.add(floor)
+    return affected
+
+# Re-solve the given floors of the day starting from the existing rota, or regenerate the whole
+# day if floors is None. The day's rota is read once for all of its floors. Raises
+# UnsolvedFloorError without saving the floor if it could not be solved, so a failed solve
+# never replaces a stored rota with nothing
+def regenerate_day_for_time_off(date, floors, employee_data, task_data, floor_data, unavailability, settings):
+    stored = storage.get_rota_records_for_day(date)
+    unavailable = unavailability.unavailable_on(date)
+    if floors is None:
+        print(f'---------Generating Rota for {date}------------------')
+        floor_rotas = {}
+        for floor in floor_data:
+            floor_rota = gen_rota_for_floor(date, employee_data, task_data, floor_data, floor, unavailable, settings,
+                                            interactive_solver_service)
+            record_floor_solve(floor_rota.stats)
+            if not floor_rota.stats.is_solved():
+                print_unsolved_floor(floor_rota.stats)
+                raise UnsolvedFloorError(floor_rota.stats)
+            floor_rotas[floor] = floor_rota
+        save_rota_for_day(date, iter_records(floor_rota.records for floor_rota in floor_rotas.values()), stored=stored)
+    else:
+        for floor in sorted(floors):
+            print(f'---------Re-solving Rota for {floor} on {date}------------------')
+            existing = [record for record in stored if record['fields'].get('Floor') == floor]
+            floor_rota = regen_rota_for_floor(date, employee_data, task_data, floor_data, floor, existing,
+                                              unavailable, settings)
+            record_floor_solve(floor_rota.stats)
+            print(f'*********Re-solved {floor} on {date}: {floor_rota.stats.status} in {floor_rota.stats.wall_time:.3f}s****************')
+            if not floor_rota.stats.is_solved():
+                print_unsolved_floor(floor_rota.stats)
+                raise UnsolvedFloorError(floor_rota.stats)
+            save_rota_for_day(date, floor_rota.records, floor=floor, stored=existing)
+    print(f'---------Generating Rota for {date} complete------------------')
+
+def unsolved_floor_response(stats):
+    return make_response(jsonify({
+        'error': f'Failed to generate rota with time-off for {stats.floor} on {stats.date}, '
+                 f'the stored rota was kept: {stats.status}.',
+        'floor': stats.floor,
+        'date': stats.date,
+        'reasons': [reason['message'] for reason in stats.infeasibility or []]
+    }), 409)
+
+# Request counts, timings and model sizes in the Prometheus text format
+@app.route('/metrics')
+def metrics():
+    if not registry.enabled:
+        return make_response(jsonify({
+            'error': 'Metrics are disabled, set METRICS_ENABLED to collect them.'
+        }), 404)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Drop cached Employee, Floors and Tasks data after those tables are edited in Airtable
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_reference_data():
+    data = request.get_json(silent=True) or {}
+
+    # Invalidate the listed tables, or all of them if none are given
+    tables = data.get('Tables')
+    unknown_tables = [table for table in tables or [] if table not in reference_data.loaders]
+    if unknown_tables:
+        return make_response(jsonify({
+            'error': 'Unknown tables in request data.',
+            'unknown_tables': unknown_tables
+        }), 400)
+    reference_data.invalidate(tables)
+    return "Invalidated reference data cache.\n"
+
 # Check if the date string refers to a valid date
 def is_valid_date(date_str):
     try:
@@ -133,6 +402,14 @@ def is_valid_date(date_str):
         return False
     return True
 
+# Employee id of a request as an int, from a number or a string of digits, None if it is neither
+def parse_employee_id(value):
+    if isinstance(value, str) and value.strip().isdecimal():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    return None
+
 # Run the app
 if __name__ == '__main__':
 
@@ -0,0 +1,113 @@
+import argparse
+import os
+import tempfile
+import time
+from datetime import date as Date, timedelta
+
+from scheduler import gen_rota_for_date_range
+from solver_config import default_solver_settings
+from storage import storage, AirtableStorage
+from synthetic_data import generate_workforce
+
+# End to end benchmark of rota generation against an in-memory Airtable, e.g.
+#   python benchmark.py --sizes 10 100 1000 --days 7 --rate 5
+# or, with ROTA_STORAGE=sqlite, against a fresh SQLite file in a temporary directory
+
+
+# Collects the per-floor and per-day timings reported by the scheduler
+class BenchmarkProgress:
+    def __init__(self):
+        self.floors = []
+        self.save_times = []
+        self.failed_days = {}
+
+    def day_started(self, date, floors):
+        pass
+
+    def floor_done(self, date, floor, stats):
+        self.floors.append(stats)
+
+    def day_done(self, date, save_time):
+        self.save_times.append(save_time)
+
+    def day_failed(self, date, error):
+        self.failed_days[date] = error
+
+
+def run_benchmark(num_employees, days, rate_limit, latency, workers, settings, seed):
+    start_date = Date(2024, 1, 1)
+    end_date = start_date + timedelta(days=days - 1)
+
+    tables = generate_workforce(num_employees, start_date, days, seed=seed)
+    if isinstance(storage, AirtableStorage):
+        # Fill a fresh in-memory base and point the Airtable client at it
+        import airtable
+        from fake_airtable import FakeAirtable
+        base = FakeAirtable(rate_limit=rate_limit, latency=latency)
+        for table, rows in tables.items():
+            base.add_records(table, rows)
+        airtable.client.session.mount('https://api.airtable.com/', base.adapter())
+        airtable.client.limiter = airtable.RateLimiter(rate_limit or float('inf'))
+    else:
+        # Never touch the configured database, every run gets a new file
+        base = None
+        storage.path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+        storage.import_tables(tables)
+
+    load_start = time.perf_counter()
+    employee_data = storage.get_employee_data()
+    floor_data = storage.get_floor_data()
+    task_data = storage.get_task_data()
+    load_time = time.perf_counter() - load_start
+
+    progress = BenchmarkProgress()
+    total_start = time.perf_counter()
+    gen_rota_for_date_range(start_date.isoformat(), end_date.isoformat(), employee_data, task_data, floor_data,
+                            workers, progress, settings)
+    total_time = time.perf_counter() - total_start
+
+    return {
+        'employees': num_employees,
+        'floors': len(floor_data),
+        'days': days,
+        'load': load_time,
+        'build': sum(stats.build_time for stats in progress.floors),
+        'solve': sum(stats.wall_time for stats in progress.floors),
+        'extract': sum(stats.extract_time for stats in progress.floors),
+        'persist': sum(progress.save_times),
+        'total': total_time,
+        'unsolved': sum(1 for stats in progress.floors if not stats.is_solved()),
+        'requests': sum(base.requests.values()) if base else 0,
+        'rate_limited': base.rate_limited if base else 0,
+        'records': len(base.records('Rota')) if base else storage.count_rota_records()
+    }
+
+
+def print_results(results):
+    columns = ['employees', 'floors', 'days', 'load', 'build', 'solve', 'extract', 'persist', 'total',
+               'unsolved', 'requests', 'rate_limited', 'records']
+    print(' '.join(f'{column:>12}' for column in columns))
+    for result in results:
+        print(' '.join(
+            f'{result[column]:>12.3f}' if isinstance(result[column], float) else f'{result[column]:>12}'
+            for column in columns
+        ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark rota generation against an in-memory Airtable.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000], help='Numbers of employees')
+    parser.add_argument('--days', type=int, default=1, help='Days in the generated range')
+    parser.add_argument('--rate', type=float, default=None, help='Airtable requests per second, unlimited if omitted')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every Airtable request')
+    parser.add_argument('--workers', type=int, default=1, help='Solver processes')
+    parser.add_argument('--solve-mode', default=default_solver_settings.solve_mode, help="'exact', 'decomposed', 'interval' or 'week'")
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic workforce')
+    args = parser.parse_args()
+
+    settings = default_solver_settings.with_overrides({'SolveMode': args.solve_mode})
+    results = []
+    for size in args.sizes:
+        print(f'---------Benchmarking {size} employees------------------')
+        results.append(run_benchmark(size, args.days, args.rate, args.latency, args.workers, settings, args.seed))
+    print_results(results)
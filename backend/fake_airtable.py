@@ -0,0 +1,240 @@
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from requests.adapters import BaseAdapter
+
+# In-memory stand-in for the Airtable REST API, mounted on the client's requests session so the
+# real airtable.py code paths run against it. It implements listRecords and table listing with
+# pagination, batched create/update/delete limited to 10 records, filterByFormula for the
+# formulas this app sends, and the 5 requests per second rate limit answered with 429.
+
+PAGE_SIZE = 100
+BATCH_LIMIT = 10
+
+
+class FakeAirtable:
+    def __init__(self, rate_limit=5.0, latency=0.0):
+        # table name -> {record id: record}
+        self.tables = {}
+        # Requests per second allowed before answering 429, None for no limit
+        self.rate_limit = rate_limit
+        # Seconds added to every request to mimic the network round trip
+        self.latency = latency
+        self.next_id = 0
+        self.request_times = []
+        # (method, table) -> number of requests
+        self.requests = {}
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    # Load records given as lists of field dicts into a table
+    def add_records(self, table, fields_list):
+        with self.lock:
+            records = self.tables.setdefault(table, {})
+            for fields in fields_list:
+                record = self.new_record(fields)
+                records[record['id']] = record
+
+    def new_record(self, fields):
+        self.next_id += 1
+        return {
+            'id': f'rec{self.next_id:014d}',
+            'createdTime': '2024-01-01T00:00:00.000Z',
+            'fields': dict(fields)
+        }
+
+    def records(self, table):
+        return list(self.tables.get(table, {}).values())
+
+    def adapter(self):
+        return FakeAirtableAdapter(self)
+
+    # Handle one request, returns (status code, JSON body)
+    def handle(self, method, path, query, body):
+        parts = [part for part in path.split('/') if part]
+        # /v0/<base>/<table>[/listRecords]
+        table = parts[2]
+        list_records = len(parts) > 3 and parts[3] == 'listRecords'
+
+        with self.lock:
+            self.requests[(method, table)] = self.requests.get((method, table), 0) + 1
+            if self.is_rate_limited():
+                self.rate_limited += 1
+                return 429, {'errors': [{'error': 'RATE_LIMIT_REACHED'}]}
+
+            records = self.tables.setdefault(table, {})
+            if method == 'GET' or (method == 'POST' and list_records):
+                params = body if method == 'POST' else {key: values[0] for key, values in query.items()}
+                return self.list(records, params)
+            if method == 'POST':
+                return self.create(records, body.get('records', []))
+            if method == 'PATCH':
+                return self.update(records, body.get('records', []))
+            if method == 'DELETE':
+                return self.delete(records, query.get('records[]', []))
+        return 404, {'error': 'NOT_FOUND'}
+
+    # Sliding one second window, the same limit Airtable applies per base
+    def is_rate_limited(self):
+        now = time.monotonic()
+        self.request_times = [t for t in self.request_times if now - t < 1]
+        if self.rate_limit is not None and len(self.request_times) >= self.rate_limit:
+            return True
+        self.request_times.append(now)
+        return False
+
+    def list(self, records, params):
+        matches = list(records.values())
+        formula = params.get('filterByFormula')
+        if formula:
+            expression = parse_formula(formula)
+            matches = [record for record in matches if expression(record['fields'])]
+        # Later sort fields only break ties, so apply them first with a stable sort
+        for sort in reversed(params.get('sort', [])):
+            matches.sort(key=lambda record: sort_key(record['fields'].get(sort['field'])),
+                         reverse=sort.get('direction') == 'desc')
+        if params.get('fields'):
+            matches = [
+                dict(record, fields={field: record['fields'][field] for field in params['fields'] if field in record['fields']})
+                for record in matches
+            ]
+
+        page_size = min(int(params.get('pageSize', PAGE_SIZE)), PAGE_SIZE)
+        start = int(params.get('offset', 0))
+        page = {'records': matches[start:start + page_size]}
+        if start + page_size < len(matches):
+            page['offset'] = str(start + page_size)
+        return 200, page
+
+    def create(self, records, new_records):
+        if len(new_records) > BATCH_LIMIT:
+            return 422, {'error': 'INVALID_RECORDS'}
+        created = []
+        for new_record in new_records:
+            record = self.new_record(new_record['fields'])
+            records[record['id']] = record
+            created.append(record)
+        return 200, {'records': created}
+
+    def update(self, records, changes):
+        if len(changes) > BATCH_LIMIT:
+            return 422, {'error': 'INVALID_RECORDS'}
+        if any(change['id'] not in records for change in changes):
+            return 404, {'error': 'NOT_FOUND'}
+        for change in changes:
+            records[change['id']]['fields'].update(change['fields'])
+        return 200, {'records': [records[change['id']] for change in changes]}
+
+    def delete(self, records, record_ids):
+        if len(record_ids) > BATCH_LIMIT:
+            return 422, {'error': 'INVALID_RECORDS'}
+        if any(record_id not in records for record_id in record_ids):
+            return 404, {'error': 'NOT_FOUND'}
+        for record_id in record_ids:
+            del records[record_id]
+        return 200, {'records': [{'id': record_id, 'deleted': True} for record_id in record_ids]}
+
+
+# Transport adapter that answers requests from a FakeAirtable instead of the network
+class FakeAirtableAdapter(BaseAdapter):
+    def __init__(self, base):
+        super().__init__()
+        self.base = base
+
+    def send(self, request, **kwargs):
+        if self.base.latency:
+            time.sleep(self.base.latency)
+        url = urlparse(request.url)
+        body = json.loads(request.body) if request.body else {}
+        status, payload = self.base.handle(request.method, url.path, parse_qs(url.query), body)
+
+        response = requests.Response()
+        response.status_code = status
+        response.url = request.url
+        response.request = request
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(payload).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+# Formula support covers the functions used by airtable.py: AND, OR, NOT, IS_SAME, IS_AFTER,
+# IS_BEFORE, {Field} references, 'strings', numbers and = comparisons
+TOKEN = re.compile(r"\s*(?:('(?:[^'\\]|\\.)*')|(\{[^}]*\})|(-?\d+(?:\.\d+)?)|([A-Z_]+)|(.))")
+
+def parse_formula(formula):
+    tokens = [token for token in TOKEN.findall(formula) if any(token)]
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take(symbol=None):
+        nonlocal position
+        token = tokens[position]
+        if symbol is not None and token[4] != symbol:
+            raise ValueError(f'Expected {symbol} in formula: {formula}')
+        position += 1
+        return token
+
+    def expression():
+        left = primary()
+        if peek() and peek()[4] == '=':
+            take('=')
+            right = primary()
+            return lambda fields: equal(left(fields), right(fields))
+        return left
+
+    def primary():
+        string, field, number, name, symbol = take()
+        if string:
+            value = re.sub(r"\\(.)", r"\1", string[1:-1])
+            return lambda fields: value
+        if field:
+            field_name = field[1:-1]
+            return lambda fields: fields.get(field_name)
+        if number:
+            value = float(number)
+            return lambda fields: value
+        if name:
+            take('(')
+            args = []
+            while peek()[4] != ')':
+                args.append(expression())
+                if peek()[4] == ',':
+                    take(',')
+            take(')')
+            function = FUNCTIONS[name]
+            return lambda fields: function(*[arg(fields) for arg in args])
+        raise ValueError(f'Unexpected {symbol!r} in formula: {formula}')
+
+    parsed = expression()
+    return lambda fields: bool(parsed(fields))
+
+# Empty cells sort first, as in Airtable
+def sort_key(value):
+    return (value is not None, value if value is not None else 0)
+
+def equal(left, right):
+    try:
+        return float(left) == float(right)
+    except (TypeError, ValueError):
+        return left == right
+
+def day(value):
+    return str(value)[:10] if value else None
+
+FUNCTIONS = {
+    'AND': lambda *args: all(args),
+    'OR': lambda *args: any(args),
+    'NOT': lambda value: not value,
+    'IS_SAME': lambda a, b, unit='day': day(a) is not None and day(a) == day(b),
+    'IS_AFTER': lambda a, b: day(a) is not None and day(b) is not None and day(a) > day(b),
+    'IS_BEFORE': lambda a, b: day(a) is not None and day(b) is not None and day(a) < day(b)
+}
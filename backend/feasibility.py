@@ -0,0 +1,81 @@
+import math
+
+# Capacity checks run before a floor's model is built. Each check is a necessary condition
+# for a rota to exist, so a floor failing one is rejected without calling the solver. The
+# checks are linear in the number of employees and tasks.
+
+
+# Return a list of reasons the floor cannot be staffed, empty if no check fails. hours and
+# break_hours hold the day's slots, max_run is the most slots in a row on one task, min_gap the
+# fewest slots between two runs on the same task and break_length the slots of a break
+def check_floor_capacity(employees, floor_data, task_data, hours, break_hours, max_run=2, break_length=1, min_gap=1):
+    reasons = []
+    headcount = len(employees)
+    break_slots = len(break_hours)
+
+    qualified = {task: 0 for task in floor_data['Tasks List']}
+    for e in employees:
+        for task in floor_data['Tasks List']:
+            if task in employees[e]['Tasks']:
+                qualified[task] += 1
+
+    total_required = 0
+    for task in floor_data['Tasks List']:
+        required = task_data[task]['Employees Required']
+        total_required += required
+        if not required:
+            continue
+
+        # Enough qualified employees for a single hour
+        if qualified[task] < required:
+            reasons.append(capacity_reason(
+                'qualified_headcount', task, required, qualified[task],
+                f'{task} needs {required} employees every hour but only {qualified[task]} are qualified'
+            ))
+            continue
+
+        # Nobody can do a task for more than max_run slots in a row followed by min_gap slots of
+        # something else, so any window of max_run + min_gap slots needs window * required
+        # assignments from employees giving at most max_run each
+        window = max_run + min_gap
+        if len(hours) >= window and max_run * qualified[task] < window * required:
+            needed = math.ceil(window * required / max_run)
+            reasons.append(capacity_reason(
+                'rotation', task, needed, qualified[task],
+                f'{task} needs {needed} qualified employees to rotate under the 2 hour rule '
+                f'but only {qualified[task]} are qualified'
+            ))
+            continue
+
+        # Every qualified employee spends break_length of the break slots on break
+        if qualified[task] * (break_slots - break_length) < required * break_slots:
+            needed = math.ceil(required * break_slots / (break_slots - break_length)) if break_slots > break_length else None
+            reasons.append(capacity_reason(
+                'break_cover', task, needed, qualified[task],
+                f'{task} cannot be covered while its {qualified[task]} qualified employees take their breaks'
+            ))
+
+    # The whole floor needs enough staff each hour, and enough over the break window for everyone's break
+    if total_required > headcount:
+        reasons.append(capacity_reason(
+            'floor_headcount', None, total_required, headcount,
+            f'The floor needs {total_required} employees every hour but only {headcount} are available'
+        ))
+    elif headcount * (break_slots - break_length) < total_required * break_slots:
+        needed = math.ceil(total_required * break_slots / (break_slots - break_length)) if break_slots > break_length else None
+        reasons.append(capacity_reason(
+            'floor_break_cover', None, needed, headcount,
+            f'The floor needs {total_required} employees every hour, which {headcount} available employees '
+            f'cannot cover while taking their breaks'
+        ))
+    return reasons
+
+
+def capacity_reason(check, task, required, available, message):
+    return {
+        'check': check,
+        'task': task,
+        'required': required,
+        'available': available,
+        'message': message
+    }
@@ -0,0 +1,422 @@
+import math
+import os
+import threading
+import time
+from dataclasses import replace
+from ortools.sat.python import cp_model
+from symmetry import solve_decomposed
+from interval_model import solve_interval, max_run, min_gap
+from solver_config import default_slot_grid, SolveStats, FloorRota
+from feasibility import check_floor_capacity
+from rota_table import HOURS, BREAK_HOURS, RotaTable, ROAMING, BREAK, rota_records, rota_slots
+
+# The CP-SAT floor models. Only solver processes import this module, see solver_service.py,
+# so processes that never solve do not load OR-Tools.
+
+# Seconds allowed for re-solving a floor when time-off is added
+regen_time_limit = float(os.getenv('ROTA_REGEN_TIME_LIMIT', '0.5'))
+
+# Seconds allowed for each solve while narrowing down the conflicting requirements of an infeasible floor
+diagnosis_time_limit = float(os.getenv('ROTA_DIAGNOSIS_TIME_LIMIT', '5'))
+
+# Seconds a week solve may go without finding a fairer rota before the best one found is used,
+# a rota only counts as fairer if its objective is at least ROTA_WEEK_MIN_IMPROVEMENT lower.
+# CP-SAT can rarely prove a week optimal and late rotas are barely fairer, so without this
+# every week runs to its time limit
+week_improvement_time = float(os.getenv('ROTA_WEEK_IMPROVEMENT_TIME', '10'))
+week_min_improvement = float(os.getenv('ROTA_WEEK_MIN_IMPROVEMENT', '0.01'))
+
+
+# Build and solve the model for a floor's available employees
+def solve_floor(date, floor, employees, floor_data, task_data, settings):
+    # A single day has nothing to balance across days, week mode solves it with the exact model
+    solve_mode = 'exact' if settings.solve_mode == 'week' else settings.solve_mode
+    stats = SolveStats(date, floor, solve_mode, 'UNKNOWN', len(employees))
+
+    if settings.solve_mode == 'interval':
+        return solve_floor_interval(date, floor, employees, floor_data, task_data, settings, stats)
+
+    # Reject floors that cannot be staffed before building a model
+    reasons = check_floor_capacity(employees, floor_data, task_data, HOURS, BREAK_HOURS)
+    if reasons:
+        stats.status = 'INFEASIBLE'
+        stats.infeasibility = reasons
+        return FloorRota([], stats)
+
+    if settings.solve_mode == 'decomposed':
+        status, assignment = solve_decomposed(employees, floor_data, task_data, HOURS, BREAK_HOURS, settings, stats)
+        if assignment is not None:
+            extract_start = time.perf_counter()
+            records = rota_records(date, floor, employees, assignment)
+            stats.extract_time = time.perf_counter() - extract_start
+            return FloorRota(records, stats)
+        if not stats.is_solved():
+            if stats.status == 'INFEASIBLE':
+                stats.infeasibility = diagnose_floor(employees, floor_data, task_data, floor)
+            return FloorRota([], stats)
+        # The headcounts could not be handed out, solve the full model instead
+        stats.solve_mode = 'exact'
+
+    build_start = time.perf_counter()
+    model, assignments, breaks = build_floor_model(employees, floor_data, task_data, floor)
+    stats.build_time = time.perf_counter() - build_start
+
+    # Run the solver
+    solver = cp_model.CpSolver()
+    settings.apply(solver)
+    status = solver.Solve(model)
+    stats.record_solver(solver, status, model)
+    if status == cp_model.INFEASIBLE:
+        stats.infeasibility = diagnose_floor(employees, floor_data, task_data, floor)
+
+    extract_start = time.perf_counter()
+    records = extract_floor_records(date, floor, employees, floor_data, solver, status, assignments, breaks)
+    stats.extract_time = time.perf_counter() - extract_start
+    return FloorRota(records, stats)
+
+# Solve the floor with the interval model on the configured slot grid
+def solve_floor_interval(date, floor, employees, floor_data, task_data, settings, stats):
+    grid = default_slot_grid
+    reasons = check_floor_capacity(
+        employees, floor_data, task_data, grid.slots(),
+        range(grid.break_start, grid.break_end, grid.slot_minutes),
+        max_run=max_run(grid), break_length=grid.to_slots(grid.break_minutes), min_gap=min_gap(grid)
+    )
+    if reasons:
+        stats.status = 'INFEASIBLE'
+        stats.infeasibility = reasons
+        return FloorRota([], stats)
+
+    status, assignment = solve_interval(employees, floor_data, task_data, grid, settings, stats)
+    if assignment is None:
+        return FloorRota([], stats)
+    extract_start = time.perf_counter()
+    records = rota_records(date, floor, employees, assignment, grid)
+    stats.extract_time += time.perf_counter() - extract_start
+    return FloorRota(records, stats)
+
+# Share of a floor's week time limit the week model may use, the rest is kept for solving the
+# days one by one if the week model finds nothing
+WEEK_MODEL_SHARE = 0.75
+
+
+# Solve a floor for several days in one model, returns a FloorRota for each date.
+# employees_by_date holds the floor's available employees of each date. Every day gets the
+# day's rules from build_floor_model, and the days are tied together by add_week_fairness.
+# time_limit bounds the seconds spent on the floor's week, including any fallback day solves
+def solve_floor_week(dates, floor, employees_by_date, floor_data, task_data, settings, time_limit):
+    start = time.perf_counter()
+    floor_rotas = {}
+    days = []
+    for date in dates:
+        employees = employees_by_date[date]
+        reasons = check_floor_capacity(employees, floor_data, task_data, HOURS, BREAK_HOURS)
+        if reasons:
+            stats = SolveStats(date, floor, 'week', 'INFEASIBLE', len(employees), infeasibility=reasons)
+            floor_rotas[date] = FloorRota([], stats)
+        else:
+            days.append(date)
+
+    if days:
+        build_start = time.perf_counter()
+        model = cp_model.CpModel()
+        day_vars = {}
+        for date in days:
+            _, assignments, breaks = build_floor_model(employees_by_date[date], floor_data, task_data, floor, model)
+            day_vars[date] = (assignments, breaks)
+        add_week_fairness(model, days, employees_by_date, floor_data, day_vars)
+        build_time = time.perf_counter() - build_start
+
+        solver = cp_model.CpSolver()
+        settings.apply(solver)
+        solver.parameters.max_time_in_seconds = max(0.0, time_limit * WEEK_MODEL_SHARE - build_time)
+        stop = StopWithoutImprovement(solver, week_improvement_time, week_min_improvement)
+        try:
+            status = solver.Solve(model, stop)
+        finally:
+            stop.cancel()
+
+        if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+            # One copy of the week's solution is read by every day
+            values = list(solver.ResponseProto().solution)
+            for date in days:
+                employees = employees_by_date[date]
+                stats = SolveStats(date, floor, 'week', 'UNKNOWN', len(employees))
+                stats.record_solver(solver, status, model)
+                # The week's build and solve are shared out equally between its days
+                stats.build_time = build_time / len(days)
+                stats.wall_time /= len(days)
+                stats.branches //= len(days)
+                stats.conflicts //= len(days)
+
+                extract_start = time.perf_counter()
+                assignments, breaks = day_vars[date]
+                records = extract_floor_records(date, floor, employees, floor_data, solver, status, assignments, breaks,
+                                                values)
+                stats.extract_time = time.perf_counter() - extract_start
+                floor_rotas[date] = FloorRota(records, stats)
+        else:
+            # No rota for the whole week, either a day cannot be staffed or the time ran out.
+            # Solve the days one by one so the days that can be staffed still get a rota and
+            # the others are diagnosed. The days share what is left of the time limit
+            print(f'********No week rota for {floor} from {dates[0]}: {solver.StatusName(status)}, solving each day****************')
+            for i, date in enumerate(days):
+                remaining = time_limit - (time.perf_counter() - start)
+                day_settings = replace(settings, solve_mode='exact', max_time=max(0.01, remaining / (len(days) - i)))
+                floor_rotas[date] = solve_floor(date, floor, employees_by_date[date], floor_data, task_data, day_settings)
+
+    return [floor_rotas[date] for date in dates]
+
+# Stops a minimising solver once patience seconds pass without a solution at least min_improvement
+# (a share of the objective) better than the one the wait started from. The wait starts at the
+# first solution so a solve still gets its whole time limit to find one
+class StopWithoutImprovement(cp_model.CpSolverSolutionCallback):
+    def __init__(self, solver, patience, min_improvement):
+        super().__init__()
+        self.solver = solver
+        self.patience = patience
+        self.min_improvement = min_improvement
+        self.objective = None
+        self.timer = None
+
+    def on_solution_callback(self):
+        objective = self.ObjectiveValue()
+        if self.objective is not None and objective > self.objective * (1 - self.min_improvement):
+            return
+        self.objective = objective
+        self.cancel()
+        self.timer = threading.Timer(self.patience, self.solver.StopSearch)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+# Balance the week's rota between employees and days:
+# - Roaming hours per working day are spread as evenly as possible between employees who can
+#   do the same tasks, employees qualified for fewer tasks cannot help roaming more
+# - Employees avoid the same task in the same hour on consecutive working days
+# - Employees avoid taking their break in the same hour on consecutive working days
+def add_week_fairness(model, days, employees_by_date, floor_data, day_vars):
+    # Roaming per working day is compared in units of 1/scale hours, so employees working a
+    # different number of days are compared with integer arithmetic
+    scale = math.lcm(*range(1, len(days) + 1))
+    employee_days = {}
+    employee_tasks = {}
+    for date in days:
+        for e, employee in employees_by_date[date].items():
+            employee_days.setdefault(e, []).append(date)
+            employee_tasks[e] = tuple(task for task in floor_data['Tasks List'] if task in employee['Tasks'])
+
+    roaming = {}
+    repeats = []
+    for e, worked in employee_days.items():
+        # Every hour without a task or the break is spent roaming
+        task_hours = sum(
+            day_vars[date][0][(e, t, task)] for date in worked for t in HOURS for task in employee_tasks[e]
+        )
+        roaming.setdefault(employee_tasks[e], []).append(
+            ((len(HOURS) - 1) * len(worked) - task_hours) * (scale // len(worked))
+        )
+
+        for previous, date in zip(worked, worked[1:]):
+            (previous_assignments, previous_breaks), (assignments, breaks) = day_vars[previous], day_vars[date]
+            pairs = [(previous_breaks[(e, t)], breaks[(e, t)]) for t in BREAK_HOURS]
+            pairs += [
+                (previous_assignments[(e, t, task)], assignments[(e, t, task)])
+                for t in HOURS for task in employee_tasks[e]
+            ]
+            for before, after in pairs:
+                repeat = model.NewBoolVar(f'repeat_{e}_{date}')
+                model.Add(repeat >= before + after - 1)
+                repeats.append(repeat)
+
+    spreads = []
+    for tasks, expressions in roaming.items():
+        if len(expressions) < 2 or not tasks:
+            continue
+        most_roaming = model.NewIntVar(0, len(HOURS) * scale, f'most_roaming_{"_".join(tasks)}')
+        least_roaming = model.NewIntVar(0, len(HOURS) * scale, f'least_roaming_{"_".join(tasks)}')
+        for expression in expressions:
+            model.Add(most_roaming >= expression)
+            model.Add(least_roaming <= expression)
+        spreads.append(most_roaming - least_roaming)
+
+    # A repeat is one hour of the week, weighed like a difference of 1/len(days) hours of roaming per day
+    model.Minimize(sum(spreads) + (scale // len(days)) * sum(repeats))
+
+# Find a minimal set of task requirements that cannot all be met together. Each task's
+# coverage constraints are switched on by an assumption, CP-SAT names a subset of assumptions
+# behind the infeasibility, and that subset is shrunk one task at a time
+def diagnose_floor(employees, floor_data, task_data, floor):
+    tasks = [task for task in floor_data['Tasks List'] if task_data[task]['Employees Required']]
+    model = cp_model.CpModel()
+    requirements = {task: model.NewBoolVar(f'require_{task}') for task in tasks}
+    build_floor_model(employees, floor_data, task_data, floor, model, requirements)
+
+    # Returns the tasks CP-SAT blames if the requirements of the given tasks conflict, else None
+    def conflicting(subset):
+        model.ClearAssumptions()
+        model.AddAssumptions([requirements[task] for task in subset])
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = diagnosis_time_limit
+        solver.parameters.num_search_workers = 1
+        if solver.Solve(model) != cp_model.INFEASIBLE:
+            return None
+        blamed = set(solver.SufficientAssumptionsForInfeasibility())
+        return [task for task in subset if requirements[task].Index() in blamed]
+
+    core = conflicting(tasks)
+    if core is None:
+        return [{
+            'check': 'conflicting_requirements',
+            'tasks': None,
+            'message': 'The floor could not be staffed but the conflicting requirements could not be identified in time'
+        }]
+    for task in list(core):
+        if task in core:
+            smaller = conflicting([t for t in core if t != task])
+            if smaller is not None:
+                core = smaller
+    return [{
+        'check': 'conflicting_requirements',
+        'tasks': core,
+        'message': f'The requirements of {", ".join(core)} cannot all be met together' if core
+                   else 'The floor cannot be staffed whatever the task requirements'
+    }]
+
+# Re-solve a floor keeping as much of its existing rota as possible
+def resolve_floor(date, floor, employees, floor_data, task_data, existing_records, settings):
+    # The minimal change objective is written for the hourly model, the interval model re-solves the floor
+    if settings.solve_mode == 'interval':
+        return solve_floor(date, floor, employees, floor_data, task_data, settings)
+    stats = SolveStats(date, floor, 'incremental', 'UNKNOWN', len(employees))
+
+    build_start = time.perf_counter()
+    model, assignments, breaks = build_floor_model(employees, floor_data, task_data, floor)
+
+    # Task each employee had in each slot of the existing rota
+    previous = {}
+    for record in existing_records:
+        fields = record['fields']
+        previous[(fields['Employee ID'], int(fields['Start Time'].split(':')[0]))] = fields['Task']
+
+    # Seed the solver with the existing rota and count every slot that differs from it
+    changes = []
+    for (e, t), previous_task in previous.items():
+        if e not in employees or t not in HOURS:
+            continue
+        slot_vars = {task: assignments[(e, t, task)] for task in floor_data['Tasks List'] if (e, t, task) in assignments}
+        if t in BREAK_HOURS:
+            slot_vars['Break'] = breaks[(e, t)]
+        for task, var in slot_vars.items():
+            model.AddHint(var, task == previous_task)
+
+        if previous_task in slot_vars:
+            changes.append(1 - slot_vars[previous_task])
+        else:
+            # Roaming, or a task the employee can no longer be given, changes if anything is assigned
+            changes.extend(slot_vars.values())
+    model.Minimize(sum(changes))
+    stats.build_time = time.perf_counter() - build_start
+
+    # Proving the minimum is rarely worth the wait, the hinted search finds a near-minimal rota quickly
+    solver = cp_model.CpSolver()
+    settings.apply(solver)
+    if settings.max_time is None:
+        solver.parameters.max_time_in_seconds = regen_time_limit
+    solver.parameters.repair_hint = True
+    status = solver.Solve(model)
+    stats.record_solver(solver, status, model)
+
+    extract_start = time.perf_counter()
+    records = extract_floor_records(date, floor, employees, floor_data, solver, status, assignments, breaks)
+    stats.extract_time = time.perf_counter() - extract_start
+    return FloorRota(records, stats)
+
+# Build the CP-SAT model for a floor's day. requirements optionally maps tasks to literals
+# that switch the task's coverage constraints on
+def build_floor_model(employees, floor_data, task_data, floor, model=None, requirements=None):
+    # Create the model
+    if model is None:
+        model = cp_model.CpModel()
+
+    # Variables
+    # Assignments: employee -> (time slot, task)
+    assignments = {}
+    for e in employees:
+        for t in HOURS:
+            for task in floor_data['Tasks List']:
+                if task in employees[e]['Tasks']:
+                    assignments[(e, t, task)] = model.NewBoolVar(f'assign_{e}_{t}_{floor}_{task}')
+
+    # Breaks: employee -> time slot
+    breaks = {}
+    for e in employees:
+        for t in BREAK_HOURS:
+            breaks[(e, t)] = model.NewBoolVar(f'break_{e}_{t}')
+
+    add_floor_constraints(model, employees, floor_data, task_data, assignments, breaks, requirements)
+    return model, assignments, breaks
+
+# Add the rota rules for one floor's day to the model
+def add_floor_constraints(model, employees, floor_data, task_data, assignments, breaks, requirements=None):
+    # 1. All tasks on a floor should have the required number of employees assigned throughout the day
+    for task in floor_data['Tasks List']:
+        for t in HOURS:
+            coverage = model.Add(sum(assignments[(e, t, task)] for e in employees if task in employees[e]['Tasks']) ==
+                                 task_data[task]['Employees Required'])
+            if requirements and task in requirements:
+                coverage.OnlyEnforceIf(requirements[task])
+
+    # 2. Each employee should not perform any given task for more than 2 back-to-back hours
+    for e in employees:
+        for task in floor_data['Tasks List']:
+            if task in employees[e]['Tasks']:
+                for start_time in range(HOURS.start, HOURS.stop - 2):  # Every 3-hour window in the day
+                    model.Add(sum(assignments[(e, t, task)]
+                                  for t in range(start_time, start_time + 3)) <= 2)
+
+    # 3. Each employee should have an hour-long break every day
+    for e in employees:
+        model.Add(sum(breaks[(e, t)] for t in BREAK_HOURS) == 1)
+
+    # 4. No task assignments during break time
+    for e in employees:
+        for t in BREAK_HOURS:
+            for task in floor_data['Tasks List']:
+                if task in employees[e]['Tasks']:
+                    model.Add(assignments[(e, t, task)] == 0).OnlyEnforceIf(breaks[(e, t)])
+
+    # 5.: Each employee is assigned at most one task per time slot
+    for e in employees:
+        for t in HOURS:
+            model.Add(sum(assignments[(e, t, task)]
+                          for task in floor_data['Tasks List'] if task in employees[e]['Tasks']) <= 1)
+
+# Read the floor's RotaTable out of the solved model. The solution is copied out of the solver
+# in one call instead of asking for every variable's value, values is an existing copy of it
+def extract_floor_records(date, floor, employees, floor_data, solver, status, assignments, breaks, values=None):
+    if status != cp_model.OPTIMAL and status != cp_model.FEASIBLE:
+        return []
+    table = RotaTable.for_employees(date, floor, employees, rota_slots(), floor_data['Tasks List'])
+    if values is None:
+        values = list(solver.ResponseProto().solution)
+    employee_index = {e: i for i, e in enumerate(table.employee_ids)}
+    slot_index = {t: i for i, t in enumerate(HOURS)}
+    task_codes = {task: table.code(task) for task in floor_data['Tasks List']}
+
+    for (e, t), var in breaks.items():
+        if values[var.Index()]:
+            table.set(employee_index[e], slot_index[t], BREAK)
+    for (e, t, task), var in assignments.items():
+        if values[var.Index()]:
+            current = table.get(employee_index[e], slot_index[t])
+            if current == BREAK:
+                print('********Error*************', 'Task during break')
+            elif current != ROAMING:
+                print('********Error*************', 'Multiple tasks')
+                print([table.labels[current], task])
+            table.set(employee_index[e], slot_index[t], task_codes[task])
+    return table
@@ -0,0 +1,159 @@
+import math
+import os
+import time
+from ortools.sat.python import cp_model
+from solver_service import solver_processes
+
+# Floor model built from optional interval variables instead of one Bool per (employee, slot, task).
+# Each employee gets a few stints per task, each a run of consecutive slots on that task, and
+# one break. The number of variables depends on the employees, tasks and stints but not on how
+# many slots the day is cut into, so finer slots or longer days keep the model the same size.
+# Times inside the model are slot numbers counted from the start of the day.
+
+# Nobody works a task for longer than this without moving to something else
+MAX_CONSECUTIVE_MINUTES = 120
+# Time spent on something else before returning to a task. With runs of at most 2 hours this
+# keeps the hourly model's rule of at most 2 hours on a task in any 3 hours at every slot size
+MIN_GAP_MINUTES = 60
+
+# Stints each employee may work on each task, 0 derives it from the slot grid
+interval_stints = int(os.getenv('ROTA_INTERVAL_STINTS', '0'))
+# Seconds allowed for solving a floor with the interval model unless MaxTime is set, the
+# solve time grows with finer slots and an unsolved floor should not hold up the whole job
+interval_time_limit = float(os.getenv('ROTA_INTERVAL_TIME_LIMIT', '30'))
+# Fewest CP-SAT workers used by the interval model when NumSearchWorkers is 0 and a single
+# solver process runs the job solves, 0 leaves the number to CP-SAT
+interval_min_workers = int(os.getenv('ROTA_INTERVAL_MIN_WORKERS', '8'))
+
+
+# Longest run of slots on one task
+def max_run(grid):
+    return max(1, grid.to_slots(MAX_CONSECUTIVE_MINUTES))
+
+# Fewest slots between two runs on the same task
+def min_gap(grid):
+    return max(1, grid.to_slots(MIN_GAP_MINUTES))
+
+# Stints each employee may work on each task. Runs of the same task are at least min_gap slots
+# apart, so ceil((slots + gap) / (run + gap)) stints let one employee cover a task for as much
+# of the day as the 2 hour rule allows. Fewer stints make a smaller model but can leave tight
+# floors unsolved
+def stints_per_task(grid, max_stints=0):
+    if max_stints:
+        return max_stints
+    return math.ceil((len(grid.slots()) + min_gap(grid)) / (max_run(grid) + min_gap(grid)))
+
+# Solve the floor on the grid and return the cp_model status together with the task, 'Break'
+# or 'Roaming' for every (employee, slot start minute), None if no rota was found. Build and
+# solver statistics are added to stats
+def solve_interval(employees, floor_data, task_data, grid, settings, stats, max_stints=interval_stints):
+    build_start = time.perf_counter()
+    model, stints, breaks = build_interval_model(employees, floor_data, task_data, grid, max_stints)
+    stats.build_time += time.perf_counter() - build_start
+
+    solver = cp_model.CpSolver()
+    settings.apply(solver)
+    if settings.max_time is None:
+        solver.parameters.max_time_in_seconds = interval_time_limit
+    # With workers left to CP-SAT a machine with few cores gets a single worker, whose fixed
+    # search rarely finds a rota at fine slots. The portfolio's local search workers do. Several
+    # solver processes already share the cores, parallel ranges set NumSearchWorkers to 1
+    if not settings.num_search_workers and interval_min_workers and solver_processes <= 1:
+        solver.parameters.num_search_workers = max(interval_min_workers, os.cpu_count() or 1)
+    status = solver.Solve(model)
+    stats.record_solver(solver, status, model)
+    if status != cp_model.OPTIMAL and status != cp_model.FEASIBLE:
+        return status, None
+
+    extract_start = time.perf_counter()
+    assignment = extract_interval_assignment(employees, grid, solver, stints, breaks)
+    stats.extract_time += time.perf_counter() - extract_start
+    return status, assignment
+
+# Build the interval model, returns the model, the stints as {(employee, task): [(present,
+# start, length), ...]} and the break start of every employee
+def build_interval_model(employees, floor_data, task_data, grid, max_stints=0):
+    model = cp_model.CpModel()
+    num_slots = len(grid.slots())
+    run = max_run(grid)
+    gap = min_gap(grid)
+    per_task = stints_per_task(grid, max_stints)
+    break_length = grid.to_slots(grid.break_minutes)
+    break_first = grid.to_slots(grid.break_start - grid.day_start)
+    break_last = grid.to_slots(grid.break_end - grid.day_start) - break_length
+
+    stints = {}
+    breaks = {}
+    task_intervals = {task: [] for task in floor_data['Tasks List']}
+    task_lengths = {task: [] for task in floor_data['Tasks List']}
+    for e in employees:
+        # 1. Each employee has a break of the set length within the break window
+        breaks[e] = model.NewIntVar(break_first, break_last, f'break_{e}')
+        employee_intervals = [model.NewFixedSizeIntervalVar(breaks[e], break_length, f'break_interval_{e}')]
+
+        for task in floor_data['Tasks List']:
+            if task not in employees[e]['Tasks']:
+                continue
+            stints[(e, task)] = []
+            for k in range(per_task):
+                present = model.NewBoolVar(f'present_{e}_{task}_{k}')
+                start = model.NewIntVar(0, num_slots - 1, f'start_{e}_{task}_{k}')
+                # 2. No run on a task is longer than the 2 hour limit
+                length = model.NewIntVar(0, run, f'length_{e}_{task}_{k}')
+                end = model.NewIntVar(0, num_slots, f'end_{e}_{task}_{k}')
+                interval = model.NewOptionalIntervalVar(start, length, end, present, f'stint_{e}_{task}_{k}')
+                model.Add(length >= 1).OnlyEnforceIf(present)
+                model.Add(length == 0).OnlyEnforceIf(present.Not())
+
+                if k:
+                    previous_present, previous_start, previous_length = stints[(e, task)][-1]
+                    # Stints are used in order, and a run on the same task must be followed by
+                    # at least an hour of something else. Ordering them also removes the
+                    # symmetric solutions that only swap stints around
+                    model.AddImplication(present, previous_present)
+                    model.Add(start >= previous_start + previous_length + gap).OnlyEnforceIf(present)
+                stints[(e, task)].append((present, start, length))
+                employee_intervals.append(interval)
+                task_intervals[task].append(interval)
+                task_lengths[task].append(length)
+
+        # 3. An employee does one thing at a time and works no task during their break
+        model.AddNoOverlap(employee_intervals)
+
+    # Employees who can do the same tasks are interchangeable, so only their break order is fixed
+    previous = {}
+    for e in employees:
+        tasks = tuple(task for task in floor_data['Tasks List'] if task in employees[e]['Tasks'])
+        if tasks in previous:
+            model.Add(breaks[previous[tasks]] <= breaks[e])
+        previous[tasks] = e
+
+    # 4. Every task has exactly the required number of employees in every slot. The cumulative
+    # caps each slot at the requirement and the total length makes every slot reach it
+    for task in floor_data['Tasks List']:
+        required = task_data[task]['Employees Required']
+        if task_intervals[task]:
+            model.AddCumulative(task_intervals[task], [1] * len(task_intervals[task]), required)
+        model.Add(sum(task_lengths[task]) == required * num_slots)
+    return model, stints, breaks
+
+# Get the task, 'Break' or 'Roaming' for every (employee, slot start minute) from the solved model
+def extract_interval_assignment(employees, grid, solver, stints, breaks):
+    slots = grid.slots()
+    break_length = grid.to_slots(grid.break_minutes)
+    assignment = {}
+    for e in employees:
+        for minute in slots:
+            assignment[(e, minute)] = 'Roaming'
+        break_start = solver.Value(breaks[e])
+        for slot in range(break_start, break_start + break_length):
+            assignment[(e, slots[slot])] = 'Break'
+
+    for (e, task), employee_stints in stints.items():
+        for present, start, length in employee_stints:
+            if not solver.Value(present):
+                break
+            start_slot = solver.Value(start)
+            for slot in range(start_slot, start_slot + solver.Value(length)):
+                assignment[(e, slots[slot])] = task
+    return assignment
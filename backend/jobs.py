@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of rota generation jobs run at the same time, later jobs wait in the queue
+rota_job_workers = int(os.getenv('ROTA_JOB_WORKERS', '1'))
+# Maximum number of queued and running jobs before new jobs are rejected
+rota_job_queue_limit = int(os.getenv('ROTA_JOB_QUEUE_LIMIT', '20'))
+# Number of finished jobs kept for status polling
+rota_job_history = int(os.getenv('ROTA_JOB_HISTORY', '100'))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+# A background job with per-day and per-floor progress, passed to the scheduler as its progress reporter
+class Job:
+    def __init__(self, description):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.status = 'queued'
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.days = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            self.status = 'running'
+            self.started_at = time.time()
+
+    def finish(self, error=None):
+        with self.lock:
+            self.status = 'failed' if error else 'complete'
+            self.error = error
+            self.finished_at = time.time()
+
+    def day_started(self, date, floors):
+        with self.lock:
+            self.days[date] = {
+                'status': 'running',
+                'started_at': time.time(),
+                'seconds': None,
+                'save_time': None,
+                'error': None,
+                'floors': {floor: None for floor in floors}
+            }
+
+    # stats is the SolveStats of the floor's solve
+    def floor_done(self, date, floor, stats):
+        with self.lock:
+            self.days[date]['floors'][floor] = stats.to_dict()
+
+    def day_done(self, date, save_time):
+        with self.lock:
+            day = self.days[date]
+            day['status'] = 'complete'
+            day['seconds'] = time.time() - day['started_at']
+            day['save_time'] = save_time
+
+    def day_failed(self, date, error):
+        with self.lock:
+            day = self.days[date]
+            day['status'] = 'failed'
+            day['seconds'] = time.time() - day['started_at']
+            day['error'] = error
+
+    def failed_days(self):
+        with self.lock:
+            return sorted(date for date, day in self.days.items() if day['status'] == 'failed')
+
+    def is_finished(self):
+        return self.status in ('complete', 'failed')
+
+    def to_dict(self):
+        with self.lock:
+            now = self.finished_at or time.time()
+            return {
+                'JobID': self.id,
+                'Description': self.description,
+                'Status': self.status,
+                'Error': self.error,
+                'QueuedSeconds': (self.started_at or now) - self.submitted_at,
+                'RunSeconds': now - self.started_at if self.started_at else None,
+                'DaysComplete': sum(1 for day in self.days.values() if day['status'] == 'complete'),
+                'Days': {
+                    date: {
+                        'Status': day['status'],
+                        'Seconds': day['seconds'],
+                        'SaveSeconds': day['save_time'],
+                        'Error': day['error'],
+                        'Floors': day['floors']
+                    }
+                    for date, day in self.days.items()
+                }
+            }
+
+
+# Bounded pool of worker threads running jobs in the order they were submitted
+class JobQueue:
+    def __init__(self, workers, limit, history):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rota-job')
+        self.limit = limit
+        self.history = history
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    # Queue fn(*args, progress=job) and return the job straight away
+    def submit(self, description, fn, *args):
+        with self.lock:
+            self.prune()
+            pending = sum(1 for job in self.jobs.values() if not job.is_finished())
+            if pending >= self.limit:
+                raise QueueFullError(f'{pending} jobs are already queued or running')
+            job = Job(description)
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job, fn, args)
+        return job
+
+    def run(self, job, fn, args):
+        job.start()
+        try:
+            fn(*args, progress=job)
+        except Exception as e:
+            print(f'---------Job {job.id} failed: {e!r}------------------')
+            job.finish(repr(e))
+            return
+        # Days fail on their own without stopping the rest of the range
+        failed_days = job.failed_days()
+        job.finish(f'{len(failed_days)} of {len(job.days)} days failed: {", ".join(failed_days)}' if failed_days else None)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    # Forget the oldest finished jobs beyond the history size
+    def prune(self):
+        finished = [job for job in self.jobs.values() if job.is_finished()]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job.id]
+
+
+rota_jobs = JobQueue(rota_job_workers, rota_job_queue_limit, rota_job_history)
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from solver_config import parse_flag
+
+# Counters and histograms rendered in the Prometheus text format on /metrics. Nothing is
+# recorded unless METRICS_ENABLED is set, and disabled metrics return straight away so the
+# instrumented code paths cost a function call.
+
+metrics_enabled = parse_flag(os.getenv('METRICS_ENABLED', 'false'))
+
+# Seconds, from a quick Airtable call up to a long solve
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Variables and constraints of a CP-SAT model
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+
+class Counter:
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+
+class Histogram:
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [count per bucket, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    # Context manager observing the seconds spent in its block
+    def time(self, **labels):
+        if not self.registry.enabled:
+            return nullcontext()
+        return Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (buckets, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, buckets):
+                    samples.append((f'{self.name}_bucket', key + (format_value(bound),), bucket_count))
+                samples.append((f'{self.name}_bucket', key + ('+Inf',), count))
+                samples.append((f'{self.name}_sum', key, total))
+                samples.append((f'{self.name}_count', key, count))
+        return samples
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(self, name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        metric = Histogram(self, name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    # Every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            kind = 'counter' if isinstance(metric, Counter) else 'histogram'
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {kind}')
+            for name, key, value in metric.samples():
+                labelnames = metric.labelnames + (('le',) if name.endswith('_bucket') else ())
+                labels = ','.join(f'{label}="{escape(value)}"' for label, value in zip(labelnames, key))
+                lines.append(f'{name}{{{labels}}} {format_value(value)}' if labels else f'{name} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry(metrics_enabled)
+
+# Airtable
+airtable_requests = registry.counter(
+    'airtable_requests_total', 'Airtable requests sent, by table, operation and response status',
+    ('table', 'operation', 'status'))
+airtable_request_seconds = registry.histogram(
+    'airtable_request_seconds', 'Seconds per Airtable request including retries and waits',
+    ('table', 'operation'))
+airtable_retries = registry.counter(
+    'airtable_retries_total', 'Airtable requests retried after a 429 or 5xx response',
+    ('table', 'operation', 'status'))
+airtable_retry_sleep_seconds = registry.counter(
+    'airtable_retry_sleep_seconds_total', 'Seconds slept backing off before retrying Airtable requests')
+airtable_rate_limit_sleep_seconds = registry.counter(
+    'airtable_rate_limit_sleep_seconds_total', 'Seconds slept waiting for the Airtable rate limiter')
+
+# Solver
+floor_solves = registry.counter(
+    'rota_floor_solves_total', 'Floor solves by solve mode, solver status and whether the solution cache answered',
+    ('mode', 'status', 'cached'))
+floor_build_seconds = registry.histogram(
+    'rota_floor_build_seconds', 'Seconds building the model of a floor', ('mode',))
+floor_solve_seconds = registry.histogram(
+    'rota_floor_solve_seconds', 'CP-SAT wall time solving a floor', ('mode', 'status'))
+floor_extract_seconds = registry.histogram(
+    'rota_floor_extract_seconds', 'Seconds turning a floor solution into rota records', ('mode',))
+model_variables = registry.histogram(
+    'rota_model_variables', 'Variables of a floor model', ('mode',), SIZE_BUCKETS)
+model_constraints = registry.histogram(
+    'rota_model_constraints', 'Constraints of a floor model', ('mode',), SIZE_BUCKETS)
+solution_cache_lookups = registry.counter(
+    'rota_solution_cache_lookups_total', 'Solution cache lookups by result, hit or miss', ('result',))
+
+# Persistence
+rota_save_seconds = registry.histogram(
+    'rota_save_seconds', 'Seconds saving the rota of a day or a floor', ('scope',))
+rota_saved_records = registry.counter(
+    'rota_saved_records_total', 'Rota records written by operation', ('operation',))
+
+
+# Record the SolveStats of a floor, called in the process that receives the stats since
+# solves can run in forked solver processes
+def record_floor_solve(stats):
+    if not registry.enabled:
+        return
+    floor_solves.inc(mode=stats.solve_mode, status=stats.status, cached=str(stats.cached).lower())
+    if stats.cached:
+        return
+    floor_build_seconds.observe(stats.build_time, mode=stats.solve_mode)
+    floor_solve_seconds.observe(stats.wall_time, mode=stats.solve_mode, status=stats.status)
+    floor_extract_seconds.observe(stats.extract_time, mode=stats.solve_mode)
+    if stats.variables:
+        model_variables.observe(stats.variables, mode=stats.solve_mode)
+        model_constraints.observe(stats.constraints, mode=stats.solve_mode)
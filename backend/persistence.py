@@ -0,0 +1,72 @@
+from storage import storage
+from rota_cache import rota_cache
+from metrics import rota_save_seconds, rota_saved_records
+
+
+# A rota slot is identified by the day, the employee and the hour it starts
+def rota_key(fields):
+    return (fields['Date'], fields['Employee ID'], fields['Start Time'])
+
+# Work out the updates, creates and deletes that turn the stored records into the new records
+def diff_rota(stored, records):
+    existing = {}
+    stale = []
+    for record in stored:
+        key = rota_key(record['fields'])
+        if key in existing:
+            # Duplicate slots left behind by an earlier run
+            stale.append(record)
+        else:
+            existing[key] = record
+
+    updates = []
+    creates = []
+    for record in records:
+        current = existing.pop(rota_key(record['fields']), None)
+        if current is None:
+            creates.append(record)
+        elif any(current['fields'].get(field) != value for field, value in record['fields'].items()):
+            updates.append({'id': current['id'], 'fields': record['fields']})
+    stale.extend(existing.values())
+
+    # Reuse records that would be deleted for the new slots, one PATCH instead of a delete and a create
+    reused = min(len(stale), len(creates))
+    for current, record in zip(stale[:reused], creates[:reused]):
+        updates.append({'id': current['id'], 'fields': record['fields']})
+    creates = creates[reused:]
+    deletes = [record['id'] for record in stale[reused:]]
+    return updates, creates, deletes
+
+# Replace the stored rota for the day with the new records, only sending the changes to storage.
+# When a floor is given only that floor's stored records are replaced, the stored records of
+# keep_floors are left as they are
+def save_rota_for_day(date, records, floor=None, stored=None, keep_floors=()):
+    whole_day = stored is None and floor is None
+    if stored is None:
+        stored = storage.get_rota_records_for_day(date)
+    if floor is not None:
+        stored = [record for record in stored if record['fields'].get('Floor') == floor]
+    replaced = [record for record in stored if record['fields'].get('Floor') not in keep_floors]
+    updates, creates, deletes = diff_rota(replaced, records)
+    print(f'---------Saving Rota for {date}: {len(updates)} updated, {len(creates)} created, {len(deletes)} deleted------------------')
+    try:
+        with rota_save_seconds.time(scope='day' if floor is None else 'floor'):
+            updated, created = storage.save_rota_changes(updates, creates, deletes)
+        rota_saved_records.inc(len(updates), operation='update')
+        rota_saved_records.inc(len(creates), operation='create')
+        rota_saved_records.inc(len(deletes), operation='delete')
+    except Exception:
+        # Part of the day may have been written, read it again on the next fetch
+        rota_cache.invalidate(date)
+        raise
+
+    # Keep the read cache in step with what was written
+    if whole_day:
+        deleted_ids = set(deletes)
+        kept = {record['id']: record for record in stored if record['id'] not in deleted_ids}
+        for record in updated + created:
+            kept[record['id']] = record
+        rota_cache.put_day(date, list(kept.values()))
+    else:
+        rota_cache.apply_changes(date, updated, created, deletes)
+    return updates, creates, deletes
@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+import time
+
+from storage import storage
+
+# Seconds before the Employee, Floors and Tasks tables are downloaded again, 0 disables the cache
+reference_cache_ttl = float(os.getenv('REFERENCE_CACHE_TTL', '300'))
+# Optional JSON file the cache is written to so a restarted process starts warm
+reference_cache_snapshot = os.getenv('REFERENCE_CACHE_SNAPSHOT')
+
+
+# Process-wide cache of the reference tables, each refreshed once its TTL has passed. Each
+# table has its own lock, so a slow download of one table does not hold up reads of the others
+class ReferenceDataCache:
+    def __init__(self, loaders, ttl, snapshot_path=None):
+        self.loaders = loaders
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        # name -> {'data', 'loaded_at'}
+        self.entries = {}
+        # name -> number of times the table was invalidated
+        self.invalidations = dict.fromkeys(loaders, 0)
+        self.table_locks = {name: threading.Lock() for name in loaders}
+        # Guards entries, invalidations and the snapshot file
+        self.lock = threading.Lock()
+        if snapshot_path:
+            self.load_snapshot()
+
+    # Get a table, downloading it again if it is missing or older than the TTL
+    def get(self, name):
+        with self.table_locks[name]:
+            with self.lock:
+                entry = self.entries.get(name)
+            if entry is None or time.time() - entry['loaded_at'] >= self.ttl:
+                entry = self.refresh(name)
+            return entry['data']
+
+    def refresh(self, name):
+        with self.lock:
+            invalidations = self.invalidations[name]
+        entry = {'data': self.loaders[name](), 'loaded_at': time.time()}
+        with self.lock:
+            # A download that started before the table was invalidated may hold the old rows,
+            # it is returned to this caller but not cached
+            if self.invalidations[name] == invalidations:
+                self.entries[name] = entry
+                self.save_snapshot()
+        return entry
+
+    # Drop the given tables, or every table, so the next get downloads them again
+    def invalidate(self, names=None):
+        with self.lock:
+            for name in list(self.loaders if names is None else names):
+                self.entries.pop(name, None)
+                self.invalidations[name] += 1
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        # Keys are stored as pairs since JSON would turn the integer employee ids into strings
+        snapshot = {
+            'entries': {
+                name: {
+                    'data': list(entry['data'].items()),
+                    'loaded_at': entry['loaded_at']
+                }
+                for name, entry in self.entries.items()
+            }
+        }
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name, entry in snapshot['entries'].items():
+            if name in self.loaders:
+                self.entries[name] = {
+                    'data': dict((key, value) for key, value in entry['data']),
+                    'loaded_at': entry['loaded_at']
+                }
+
+
+reference_data = ReferenceDataCache({
+    'employees': storage.get_employee_data,
+    'floors': storage.get_floor_data,
+    'tasks': storage.get_task_data
+}, reference_cache_ttl, reference_cache_snapshot)
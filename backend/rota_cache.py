@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from storage import storage, start_hour
+
+# Seconds a cached day is served before it is read from Airtable again. Writes made by this
+# process update the cache straight away, the TTL only bounds how stale another process's writes look
+rota_cache_ttl = float(os.getenv('ROTA_CACHE_TTL', '3600'))
+# Maximum number of days kept in memory, the least recently read days are dropped first
+rota_cache_max_days = int(os.getenv('ROTA_CACHE_MAX_DAYS', '62'))
+
+
+# A day's stored rota records with an index of each employee's rows in time order
+class DayRota:
+    def __init__(self, records):
+        self.records = {record['id']: record for record in records}
+        self.loaded_at = time.time()
+        self.reindex()
+
+    def reindex(self):
+        records = sorted(self.records.values(), key=lambda record: start_hour(record['fields']))
+        self.rows = [rota_row(record['fields']) for record in records]
+        self.by_employee = {}
+        for row in self.rows:
+            self.by_employee.setdefault(str(row[1]), []).append(row)
+
+
+# Read-through cache of the Rota table keyed by date
+class RotaCache:
+    def __init__(self, loader, ttl, max_days):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_days = max_days
+        self.days = OrderedDict()
+        # Every write or invalidation takes the next generation. written maps a date to the
+        # generation of its last write and cleared is the generation of the last full invalidation
+        self.generation = 0
+        self.written = {}
+        self.cleared = 0
+        # Reads from storage in progress, written is only needed while there are any
+        self.loading = 0
+        self.lock = threading.Lock()
+
+    # Get the day's rota rows, reading the day from storage on a miss
+    def get_rota_for_day(self, date):
+        return self.get_day(date).rows
+
+    # Get an employee's rows for the day in time order
+    def get_rota_for_employee_and_day(self, date, employee_id):
+        return self.get_day(date).by_employee.get(str(employee_id), [])
+
+    def get_day(self, date):
+        with self.lock:
+            day = self.days.get(date)
+            if day is not None and time.time() - day.loaded_at < self.ttl:
+                self.days.move_to_end(date)
+                return day
+            generation = self.generation
+            self.loading += 1
+        # Read outside the lock so a slow day does not hold up other dates. A write to the day
+        # while it is read may not be in what was read, so the read is then not cached
+        try:
+            day = DayRota(self.loader(date))
+        except Exception:
+            with self.lock:
+                self.finish_load()
+            raise
+        with self.lock:
+            if self.written.get(date, 0) <= generation and self.cleared <= generation:
+                self.store(date, day)
+            self.finish_load()
+        return day
+
+    # Replace the cached day with the complete set of stored records
+    def put_day(self, date, records):
+        with self.lock:
+            self.mark_written(date)
+            self.store(date, DayRota(records))
+
+    # Apply a write to the cached day, if the day is not cached the next read loads it
+    def apply_changes(self, date, updated=(), created=(), deleted_ids=()):
+        with self.lock:
+            self.mark_written(date)
+            day = self.days.get(date)
+            if day is None:
+                return
+            for record in list(updated) + list(created):
+                day.records[record['id']] = record
+            for record_id in deleted_ids:
+                day.records.pop(record_id, None)
+            day.reindex()
+
+    def invalidate(self, date=None):
+        with self.lock:
+            if date is None:
+                self.generation += 1
+                self.cleared = self.generation
+                self.written.clear()
+                self.days.clear()
+            else:
+                self.mark_written(date)
+                self.days.pop(date, None)
+
+    def finish_load(self):
+        self.loading -= 1
+        if not self.loading:
+            self.written.clear()
+
+    # A read starting later takes this generation or a newer one, so the date only needs
+    # remembering while reads are in progress
+    def mark_written(self, date):
+        self.generation += 1
+        if self.loading:
+            self.written[date] = self.generation
+
+    def store(self, date, day):
+        self.days[date] = day
+        self.days.move_to_end(date)
+        while len(self.days) > self.max_days:
+            self.days.popitem(last=False)
+
+
+def rota_row(fields):
+    return [
+        fields['Date'],
+        fields['Employee ID'],
+        fields['Employee Name'],
+        fields['Start Time'],
+        fields['End Time'],
+        fields['Floor'],
+        fields['Task']
+    ]
+
+
+rota_cache = RotaCache(storage.get_rota_records_for_day, rota_cache_ttl, rota_cache_max_days)
@@ -0,0 +1,106 @@
+from array import array
+
+from solver_config import format_time
+
+# Working hours of the rota, one slot per hour starting at 9am and ending at 5pm
+HOURS = range(9, 17)
+# Breaks are taken between 11am and 3pm
+BREAK_HOURS = range(11, 15)
+
+# Compact rota of one floor for one day. Every (employee, slot) holds a small integer code
+# into the labels ('Roaming', 'Break' and the floor's tasks) in a flat array, employee first.
+# The date, floor, names and slot times are kept once rather than in every record, and the
+# Airtable shaped records are only built while the table is iterated, e.g. when it is saved.
+
+ROAMING = 0
+BREAK = 1
+
+
+class RotaTable:
+    __slots__ = ('date', 'floor', 'employee_ids', 'employee_names', 'slots', 'labels', 'codes')
+
+    # slots is a list of (slot key, start time, end time), the slot key being the hour or start
+    # minute the models and the solution cache use. codes defaults to everyone roaming
+    def __init__(self, date, floor, employee_ids, employee_names, slots, tasks, codes=None):
+        self.date = date
+        self.floor = floor
+        self.employee_ids = employee_ids
+        self.employee_names = employee_names
+        self.slots = slots
+        self.labels = ['Roaming', 'Break'] + [task for task in tasks if task not in ('Roaming', 'Break')]
+        if codes is None:
+            codes = array('H', [ROAMING]) * (len(employee_ids) * len(slots))
+        self.codes = codes
+
+    # Table for the employees of a floor with every slot roaming
+    @classmethod
+    def for_employees(cls, date, floor, employees, slots, tasks):
+        return cls(date, floor, list(employees), [employees[e]['Name'] for e in employees], slots, tasks)
+
+    # Code of a task, 'Break' or 'Roaming'
+    def code(self, label):
+        return self.labels.index(label)
+
+    def set(self, employee_index, slot_index, code):
+        self.codes[employee_index * len(self.slots) + slot_index] = code
+
+    def get(self, employee_index, slot_index):
+        return self.codes[employee_index * len(self.slots) + slot_index]
+
+    # Fill the table from {(employee id, slot key): task, 'Break' or 'Roaming'}
+    def fill(self, assignment):
+        codes = {label: code for code, label in enumerate(self.labels)}
+        i = 0
+        for e in self.employee_ids:
+            for key, _, _ in self.slots:
+                self.codes[i] = codes[assignment[(e, key)]]
+                i += 1
+        return self
+
+    # Yield (employee id, slot key, label) for every cell
+    def assignment(self):
+        i = 0
+        for e in self.employee_ids:
+            for key, _, _ in self.slots:
+                yield e, key, self.labels[self.codes[i]]
+                i += 1
+
+    def __len__(self):
+        return len(self.codes)
+
+    # Yield the Airtable records, one per employee and slot
+    def __iter__(self):
+        i = 0
+        for e, name in zip(self.employee_ids, self.employee_names):
+            for _, start_time, end_time in self.slots:
+                yield {
+                    'fields': {
+                        'Date': self.date,
+                        'Employee ID': e,
+                        'Employee Name': name,
+                        'Start Time': start_time,
+                        'End Time': end_time,
+                        'Floor': self.floor,
+                        'Task': self.labels[self.codes[i]]
+                    }
+                }
+                i += 1
+
+
+# Yield the records of every table of a day in order
+def iter_records(tables):
+    for table in tables:
+        yield from table
+
+# Slots of the rota as (slot key, start time, end time), keyed by hour or by start minute when
+# the slots come from a grid
+def rota_slots(grid=None):
+    if grid is None:
+        return [(t, f'{t}:00', f'{t+1}:00') for t in HOURS]
+    return [(m, format_time(m), format_time(m + grid.slot_minutes)) for m in grid.slots()]
+
+# Create the RotaTable for the floor from the task of every (employee, hour), or of every
+# (employee, slot start minute) when the slots come from a grid
+def rota_records(date, floor, employees, assignment, grid=None):
+    table = RotaTable.for_employees(date, floor, employees, rota_slots(grid), dict.fromkeys(assignment.values()))
+    return table.fill(assignment)
@@ -1,148 +1,353 @@
+import os
+import queue
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import replace
 from datetime import datetime, timedelta
-from ortools.sat.python import cp_model
-from airtable import (
-    get_rota_record_ids_for_day,
-    get_unavailability_data,
-    delete_rota_records,
-    write_to_rota_table
-)
-
-def gen_rota_for_date_range(start_date_str, end_date_str, employee_data, task_data, floors_data):
+from storage import storage
+from persistence import save_rota_for_day
+from unavailability import load_unavailability_index
+from solver_config import default_solver_settings, default_slot_grid, SolveStats, FloorRota
+from rota_table import HOURS, BREAK_HOURS, RotaTable, iter_records, rota_records
+from solver_service import solver_service, interactive_solver_service, solver_pool, run_solver
+from solution_cache import solution_cache, solution_key
+from metrics import record_floor_solve
+
+# Solved days that may wait to be saved while the next days are being solved
+rota_pipeline_depth = int(os.getenv('ROTA_PIPELINE_DEPTH', '2'))
+
+# Seconds allowed for solving every floor of a week in week mode, the best rotas found by then are
+# used. Weeks are rarely proven optimal, a week usually takes most of this unless its search
+# stalls first, see floor_model.week_improvement_time
+week_time_limit = float(os.getenv('ROTA_WEEK_TIME_LIMIT', '120'))
+
+# progress is an optional reporter with day_started, floor_done, day_done and day_failed
+# methods, see jobs.Job. settings are the SolverSettings used for every floor.
+# Days are solved and saved in a pipeline, a failed day is reported and skipped, and the
+# errors are returned as {date: error}. A floor without a rota, e.g. stopped by a time limit,
+# keeps its stored rota and fails the day
+def gen_rota_for_date_range(start_date_str, end_date_str, employee_data, task_data, floors_data, workers=1, progress=None, settings=None):
     # Convert string dates to datetime.date objects
     start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
     end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
 
+    dates = []
     current_date = start_date
     while current_date <= end_date:
-        print(f'---------Generating Rota for {current_date.strftime("%Y-%m-%d")}------------------')
-        records = gen_rota_for_date(current_date.strftime("%Y-%m-%d"), employee_data, task_data, floors_data)
-        print(f'---------Deleting existing Rota records if any for {current_date.strftime("%Y-%m-%d")}------------------')
-        record_ids = get_rota_record_ids_for_day(current_date.strftime("%Y-%m-%d"))
-        delete_rota_records(record_ids)
-        print(f'---------Writing new Rota records for {current_date.strftime("%Y-%m-%d")}------------------')
-        write_to_rota_table(records)
-        print(f'---------Generating Rota for {current_date.strftime("%Y-%m-%d")} complete------------------')
+        dates.append(current_date.strftime("%Y-%m-%d"))
         current_date += timedelta(days=1)
 
-# ToDo: Handle failures
-def gen_rota_for_date(date, employee_data, task_data, floors_data):
-    records = []
+    # Load the holidays for the whole range once rather than once per day and floor
+    unavailability = load_unavailability_index(start_date_str, end_date_str)
+
+    settings = settings or default_solver_settings
+    if workers > 1 and not settings.num_search_workers:
+        # The solver processes already use the cores, one CP-SAT search worker each rather than
+        # every process searching on all of them
+        settings = replace(settings, num_search_workers=1)
+    if settings.solve_mode == 'week':
+        solved_days = iter_rota_for_weeks(dates, employee_data, task_data, floors_data, workers, unavailability, progress, settings)
+    elif workers > 1:
+        print(f'---------Generating Rota for {start_date_str} to {end_date_str} with {workers} workers------------------')
+        solved_days = iter_rota_for_dates_parallel(dates, employee_data, task_data, floors_data, workers, unavailability, progress, settings)
+    else:
+        solved_days = iter_rota_for_dates(dates, employee_data, task_data, floors_data, unavailability, progress, settings)
+
+    # Saving day N to Airtable overlaps with solving day N+1, the bounded queue stops the
+    # solver from running too far ahead of the writes
+    errors = {}
+    saved_days = queue.Queue(maxsize=rota_pipeline_depth)
+    saver = threading.Thread(target=save_solved_days, args=(saved_days, errors, progress), daemon=True)
+    saver.start()
+    try:
+        for date, tables, unsolved, error in solved_days:
+            if error is not None:
+                print(f'---------Generating Rota for {date} failed: {error!r}------------------')
+                errors[date] = repr(error)
+                if progress:
+                    progress.day_failed(date, repr(error))
+            else:
+                saved_days.put((date, tables, unsolved))
+    finally:
+        saved_days.put(None)
+        saver.join()
+    return errors
+
+# Persist solved days from the queue until the None sentinel arrives
+def save_solved_days(saved_days, errors, progress):
+    while True:
+        item = saved_days.get()
+        if item is None:
+            return
+        date, tables, unsolved = item
+        try:
+            save_start = time.perf_counter()
+            save_rota_for_day(date, iter_records(tables), keep_floors={stats.floor for stats in unsolved})
+            save_time = time.perf_counter() - save_start
+        except Exception as e:
+            print(f'---------Saving Rota for {date} failed: {e!r}------------------')
+            errors[date] = repr(e)
+            if progress:
+                progress.day_failed(date, repr(e))
+            continue
+        if unsolved:
+            error = '; '.join(f'No rota for {stats.floor}: {stats.status}' for stats in unsolved)
+            print(f'---------Generating Rota for {date} failed: {error}------------------')
+            errors[date] = error
+            if progress:
+                progress.day_failed(date, error)
+            continue
+        if progress:
+            progress.day_done(date, save_time)
+        print(f'---------Generating Rota for {date} complete------------------')
+
+# Yield (date, tables, unsolved, error) for each date, tables holding a RotaTable per solved
+# floor and unsolved the SolveStats of the floors without a rota, solving the floors one after another
+def iter_rota_for_dates(dates, employee_data, task_data, floors_data, unavailability, progress=None, settings=None):
+    for date in dates:
+        print(f'---------Generating Rota for {date}------------------')
+        if progress:
+            progress.day_started(date, floors_data)
+        try:
+            tables, unsolved = gen_rota_for_date(date, employee_data, task_data, floors_data, unavailability, progress, settings)
+        except Exception as e:
+            yield date, None, None, e
+            continue
+        yield date, tables, unsolved, None
+
+# Yield (date, tables, unsolved, error) for each date in order, solving (date, floor) pairs on a process pool
+def iter_rota_for_dates_parallel(dates, employee_data, task_data, floors_data, workers, unavailability, progress=None, settings=None):
+    # Floor models share no variables, so every (date, floor) pair is an independent solve.
+    # Only enough days to keep every worker busy are submitted ahead of the day being yielded
+    settings = settings or default_solver_settings
+    lookahead = -(-workers // max(1, len(floors_data))) + 1
+    pending = deque()
+    # Cache key -> Future of the solve, so a floor input repeated on days submitted before its
+    # result reached the solution cache is solved once
+    in_flight = {}
+    remaining_dates = iter(dates)
+    with solver_pool(workers) as executor:
+        def submit_next_day():
+            date = next(remaining_dates, None)
+            if date is None:
+                return
+            if progress:
+                progress.day_started(date, floors_data)
+            # Floors already in the solution cache are answered here without a trip to the pool
+            futures = []
+            for floor in floors_data:
+                unavailable = unavailability.unavailable_on(date)
+                key, floor_rota = lookup_floor_rota(date, employee_data, task_data, floors_data, floor, unavailable, settings)
+                shared = False
+                if floor_rota is None and key in in_flight:
+                    floor_rota = in_flight[key]
+                    shared = True
+                elif floor_rota is None:
+                    employees = floor_employees(employee_data, floor, unavailable)
+                    floor_rota = executor.submit(run_solver, 'solve_floor', date, floor, employees, floors_data[floor],
+                                                 task_data, settings)
+                    if solution_cache.max_entries:
+                        in_flight[key] = floor_rota
+                futures.append((key, floor_rota, shared))
+            pending.append((date, futures))
+
+        for _ in range(lookahead):
+            submit_next_day()
+        while pending:
+            date, futures = pending.popleft()
+            submit_next_day()
+            # Gather results in submission order so the records come out in the same order as a serial run
+            tables = []
+            unsolved = []
+            try:
+                for floor, (key, floor_rota, shared) in zip(floors_data, futures):
+                    if shared:
+                        floor_rota = floor_rota_for_date(floor_rota.result(), date)
+                    elif isinstance(floor_rota, Future):
+                        if in_flight.get(key) is floor_rota:
+                            del in_flight[key]
+                        floor_rota = floor_rota.result()
+                        remember_floor_rota(key, floor_rota)
+                    add_floor_rota(tables, unsolved, floor_rota)
+                    if progress:
+                        progress.floor_done(date, floor, floor_rota.stats)
+            except Exception as e:
+                yield date, None, None, e
+                continue
+            yield date, tables, unsolved, None
+
+# Yield (date, tables, unsolved, error) for each date in order, solving every floor a week (Monday to
+# Sunday) at a time in one model, see floor_model.solve_floor_week. Week solves bypass the
+# solution cache since a day's rota depends on the rest of its week
+def iter_rota_for_weeks(dates, employee_data, task_data, floors_data, workers, unavailability, progress=None, settings=None):
+    settings = settings or default_solver_settings
+    weeks = {}
+    for date in dates:
+        weeks.setdefault(datetime.strptime(date, "%Y-%m-%d").date().isocalendar()[:2], []).append(date)
+
+    # Floors of a week are independent, with several workers they are solved side by side. The
+    # week's time limit is split between the rounds of floors the solver processes work through,
+    # MaxTime when set bounds each floor instead
+    executor = solver_pool(workers) if workers > 1 else None
+    processes = workers if executor else max(1, solver_service.processes)
+    rounds = -(-len(floors_data) // processes)
+    floor_time_limit = settings.max_time or week_time_limit / max(1, rounds)
+    try:
+        for week_dates in weeks.values():
+            print(f'---------Generating Rota for {week_dates[0]} to {week_dates[-1]}------------------')
+            if progress:
+                for date in week_dates:
+                    progress.day_started(date, floors_data)
+            try:
+                futures = []
+                for floor in floors_data:
+                    employees_by_date = {
+                        date: floor_employees(employee_data, floor, unavailability.unavailable_on(date))
+                        for date in week_dates
+                    }
+                    args = ('solve_floor_week', week_dates, floor, employees_by_date, floors_data[floor], task_data, settings,
+                            floor_time_limit)
+                    futures.append(executor.submit(run_solver, *args) if executor else solver_service.submit(*args))
+                week_rotas = [future.result() for future in futures]
+            except Exception as e:
+                for date in week_dates:
+                    yield date, None, None, e
+                continue
+
+            for i, date in enumerate(week_dates):
+                tables = []
+                unsolved = []
+                for floor, floor_rotas in zip(floors_data, week_rotas):
+                    floor_rota = floor_rotas[i]
+                    add_floor_rota(tables, unsolved, floor_rota)
+                    if progress:
+                        progress.floor_done(date, floor, floor_rota.stats)
+                yield date, tables, unsolved, None
+    finally:
+        if executor:
+            executor.shutdown()
+
+# Returns the RotaTable of every solved floor and the SolveStats of the floors without a rota,
+# see rota_table.iter_records for the day's records
+def gen_rota_for_date(date, employee_data, task_data, floors_data, unavailability=None, progress=None, settings=None):
+    # Every floor shares the same holidays, so look them up once for the day
+    if unavailability is None:
+        unavailable = set(storage.get_unavailability_data(date))
+    else:
+        unavailable = unavailability.unavailable_on(date)
+
+    tables = []
+    unsolved = []
     for floor in floors_data:
         print(f'*********Generating Rota for {floor}****************')
-        floor_records = gen_rota_for_floor(date, employee_data, task_data, floors_data, floor)
-        records.extend(floor_records)
-    return records
+        floor_rota = gen_rota_for_floor(date, employee_data, task_data, floors_data, floor, unavailable, settings)
+        add_floor_rota(tables, unsolved, floor_rota)
+        if progress:
+            progress.floor_done(date, floor, floor_rota.stats)
+    return tables, unsolved
+
+# Record a floor's solve and add its rota to the day's tables, or its stats to unsolved if no
+# rota was found so the floor's stored rota is kept
+def add_floor_rota(tables, unsolved, floor_rota):
+    record_floor_solve(floor_rota.stats)
+    if floor_rota.stats.is_solved():
+        tables.append(floor_rota.records)
+    else:
+        print_unsolved_floor(floor_rota.stats)
+        unsolved.append(floor_rota.stats)
+
+# Solve a floor for the day, returns a FloorRota with the records and the SolveStats of the solve.
+# service is the SolverService the floor is solved on
+def gen_rota_for_floor(date, employee_data, task_data, floors_data, floor, unavailable=None, settings=None, service=solver_service):
+    settings = settings or default_solver_settings
+
+    # unavailable is the set of employee ids on holiday for the date
+    if unavailable is None:
+        unavailable = set(storage.get_unavailability_data(date))
+
+    key, floor_rota = lookup_floor_rota(date, employee_data, task_data, floors_data, floor, unavailable, settings)
+    if floor_rota is not None:
+        return floor_rota
+
+    employees = floor_employees(employee_data, floor, unavailable)
+    floor_rota = service.solve('solve_floor', date, floor, employees, floors_data[floor], task_data, settings)
+    remember_floor_rota(key, floor_rota)
+    return floor_rota
+
+# Look the floor's solve input up in the solution cache, returns the cache key and the cached
+# solution re-emitted for the date, or None on a miss
+def lookup_floor_rota(date, employee_data, task_data, floors_data, floor, unavailable, settings):
+    employees = floor_employees(employee_data, floor, unavailable)
+    grid = default_slot_grid if settings.solve_mode == 'interval' else None
+    key = solution_key(employees, floors_data[floor], task_data, HOURS, BREAK_HOURS, settings, grid)
+    solution = solution_cache.get(key)
+    if solution is None:
+        return key, None
 
-# ToDo: Cleanup
-def gen_rota_for_floor(date, employee_data, task_data, floors_data, floor):
+    stats = SolveStats(date, floor, settings.solve_mode, solution['status'], len(employees), cached=True,
+                       infeasibility=solution.get('infeasibility'))
+    records = []
+    if solution['assignment']:
+        extract_start = time.perf_counter()
+        assignment = {(e, t): task for e, t, task in solution['assignment']}
+        records = rota_records(date, floor, employees, assignment, grid)
+        stats.extract_time = time.perf_counter() - extract_start
+    return key, FloorRota(records, stats)
+
+# Copy of another day's FloorRota with the same solve input for the date, reported like a cache hit
+def floor_rota_for_date(floor_rota, date):
+    stats = floor_rota.stats
+    stats = SolveStats(date, stats.floor, stats.solve_mode, stats.status, stats.employees, cached=True,
+                       infeasibility=stats.infeasibility)
+    table = floor_rota.records
+    if not table:
+        return FloorRota([], stats)
+    records = RotaTable(date, table.floor, table.employee_ids, table.employee_names, table.slots, table.labels,
+                        array(table.codes.typecode, table.codes))
+    return FloorRota(records, stats)
+
+# Store a finished solve in the solution cache. Solves stopped by a time limit before finding a
+# rota are not kept, a rota found within the limit is kept even if it was not proven optimal
+def remember_floor_rota(key, floor_rota):
+    if floor_rota.stats.status not in ('OPTIMAL', 'FEASIBLE', 'INFEASIBLE'):
+        return
+    # Slots are keyed by hour, or by start minute for the interval model
+    assignment = [list(cell) for cell in floor_rota.records.assignment()] if floor_rota.records else []
+    solution_cache.put(key, {
+        'status': floor_rota.stats.status,
+        'assignment': assignment,
+        'infeasibility': floor_rota.stats.infeasibility
+    })
+
+# Re-solve a floor after its staff changed, keeping as much of the existing rota as possible. A
+# client waits on the re-solve, so it runs on the interactive solver processes
+def regen_rota_for_floor(date, employee_data, task_data, floors_data, floor, existing_records, unavailable=None, settings=None,
+                         service=interactive_solver_service):
+    settings = settings or default_solver_settings
+    if unavailable is None:
+        unavailable = set(storage.get_unavailability_data(date))
 
-    unavailability_data = get_unavailability_data(date)
+    employees = floor_employees(employee_data, floor, unavailable)
+    floor_rota = service.solve('resolve_floor', date, floor, employees, floors_data[floor], task_data,
+                                      existing_records, settings)
+    if not floor_rota.stats.is_solved():
+        # Nothing found within the regen time limit, solve the floor from scratch instead, which
+        # also diagnoses a floor that cannot be staffed
+        floor_rota = service.solve('solve_floor', date, floor, employees, floors_data[floor], task_data, settings)
+    return floor_rota
 
+# Get the employees working on the floor that are not on holiday
+def floor_employees(employee_data, floor, unavailable):
     employees = {}
     for e in employee_data:
-      if employee_data[e]['DefaultFloor'] == floor and e not in unavailability_data:
-        employees[e] = employee_data[e]
-
-    floor_data = floors_data[floor]
-
-    # Create the model
-    model = cp_model.CpModel()
-
-    # Variables
-    # Assignments: employee -> (time slot, task)
-    assignments = {}
-    for e in employees:
-        for t in range(9, 17):
-            for task in floor_data['Tasks List']:
-                if task in employees[e]['Tasks']:
-                    assignments[(e, t, task)] = model.NewBoolVar(f'assign_{e}_{t}_{floor}_{task}')
-
-    # Breaks: employee -> time slot
-    breaks = {}
-    for e in employees:
-        for t in range(11, 15):  # Breaks between 11am and 3pm
-            breaks[(e, t)] = model.NewBoolVar(f'break_{e}_{t}')
-
-    # Adding Constraints
-    # 1. All tasks on a floor should have the required number of employees assigned throughout the day
-    for task in floor_data['Tasks List']:
-        for t in range(9, 17):
-            model.Add(sum(assignments[(e, t, task)] for e in employees if task in employees[e]['Tasks']) ==
-                      task_data[task]['Employees Required'])
-
-    # 2. Each employee should not perform any given task for more than 2 back-to-back hours
-    for e in employees:
-      for task in floor_data['Tasks List']:
-          if task in employees[e]['Tasks']:
-              for start_time in range(9, 15):  # Check from 9 am to 2 pm (for 3-hour windows)
-                  model.Add(sum(assignments[(e, t, task)]
-                                for t in range(start_time, start_time + 3)) <= 2)
-
-    # 3. Each employee should have an hour-long break every day
-    for e in employees:
-        model.Add(sum(breaks[(e, t)] for t in range(11, 15)) == 1)
-
-    # 4. No task assignments during break time
-    for e in employees:
-        for t in range(11, 15):  # Breaks between 11am and 3pm
-            for task in floor_data['Tasks List']:
-                if task in employees[e]['Tasks']:
-                    model.Add(assignments[(e, t, task)] == 0).OnlyEnforceIf(breaks[(e, t)])
-
-    # 5.: Each employee is assigned at most one task per time slot
-    for e in employees:
-        for t in range(9, 17):
-            model.Add(sum(assignments[(e, t, task)]
-                          for task in floor_data['Tasks List'] if task in employees[e]['Tasks']) <= 1)
-
-    # Run the solver
-    solver = cp_model.CpSolver()
-    status = solver.Solve(model)
-
-    # Extracting and displaying the solution
-    records = []
-    if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-        for e in employees:
-            for t in range(9, 17):
-                is_on_break = False
-                if t in range(11, 15):
-                  is_on_break = solver.Value(breaks[(e, t)]) == 1
-                assigned_tasks = []
-                for task in floor_data['Tasks List']:
-                    if task in employees[e]['Tasks']:
-                      if solver.Value(assignments[(e, t, task)]) == 1:
-                        assigned_tasks.append(task)
-
-                if assigned_tasks and is_on_break:
-                    print('********Error*************', 'Task during break')
-                if not assigned_tasks and not is_on_break:
-                    assigned_task = 'Roaming'
-                elif len(assigned_tasks) > 1:
-                    print('********Error*************', 'Multiple tasks')
-                    print(assigned_tasks)
-                elif len(assigned_tasks) == 1:
-                    assigned_task = assigned_tasks[0]
-                elif is_on_break:
-                    assigned_task = 'Break'
-                else:
-                    print('********Error*************', 'Unhandled condition')
-
-                records.append({
-                    'fields': {
-                        'Date': date,
-                        'Employee ID': e,
-                        'Employee Name': employees[e]['Name'],
-                        'Start Time': f'{t}:00',
-                        'End Time': f'{t+1}:00',
-                        'Floor': floor,
-                        'Task': assigned_task
-                    }
-                })
-                # print(f'Employee {e} at {t}:00 - Floor: {floor} Task: {assigned_task}')
-    elif status == cp_model.INFEASIBLE:
-        print("No solution found: INFEASIBLE")
-    elif status == cp_model.MODEL_INVALID:
-        print("No solution found: MODEL_INVALID")
-    else:
-        print("No solution found: UNKNOWN")
-    return records
+        if employee_data[e]['DefaultFloor'] == floor and e not in unavailable:
+            employees[e] = employee_data[e]
+    return employees
+
+def print_unsolved_floor(stats):
+    print(f'********No Rota for {stats.floor} on {stats.date}: {stats.status}****************')
+    for reason in stats.infeasibility or []:
+        print(f"********{reason['message']}****************")
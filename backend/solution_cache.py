@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import asdict
+from collections import OrderedDict
+
+from metrics import solution_cache_lookups
+
+# Number of floor solutions kept in memory, 0 disables the cache
+solution_cache_size = int(os.getenv('SOLUTION_CACHE_SIZE', '1024'))
+# Optional SQLite file the solutions are also written to, so they survive restarts
+solution_cache_path = os.getenv('SOLUTION_CACHE_PATH')
+
+
+# Floor solutions keyed by a hash of everything the solve depends on. A solution is
+# {'status': <solver status>, 'assignment': [[employee id, hour, task], ...]}
+class SolutionCache:
+    def __init__(self, max_entries, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def get(self, key):
+        if not self.max_entries:
+            return None
+        with self.lock:
+            solution = self.entries.get(key)
+            if solution is None and self.path:
+                row = self.db().execute('SELECT solution FROM solutions WHERE key = ?', (key,)).fetchone()
+                if row:
+                    solution = json.loads(row[0])
+                    self.store(key, solution)
+            if solution is None:
+                solution_cache_lookups.inc(result='miss')
+                return None
+            solution_cache_lookups.inc(result='hit')
+            self.entries.move_to_end(key)
+            return solution
+
+    def put(self, key, solution):
+        if not self.max_entries:
+            return
+        with self.lock:
+            self.store(key, solution)
+            if self.path:
+                with self.db() as db:
+                    db.execute('INSERT OR REPLACE INTO solutions (key, solution) VALUES (?, ?)',
+                               (key, json.dumps(solution)))
+
+    def store(self, key, solution):
+        self.entries[key] = solution
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    # Only the web process reads and writes the cache, solver processes return their solutions
+    # to it. Its threads share one connection, used under the lock
+    def db(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, solution TEXT NOT NULL)')
+        return self.connection
+
+
+# Hash of a floor's solve input: the available employees with the floor tasks they can do,
+# the floor's tasks with their required headcount, the working hours and the solver
+# settings that change which rota comes out. grid is the SlotGrid of the interval model
+def solution_key(employees, floor_data, task_data, hours, break_hours, settings, grid=None):
+    floor_tasks = floor_data['Tasks List']
+    solve_input = {
+        'employees': sorted(
+            [e, [task for task in floor_tasks if task in employees[e]['Tasks']]] for e in employees
+        ),
+        'tasks': [[task, task_data[task]['Employees Required']] for task in floor_tasks],
+        'hours': [hours.start, hours.stop],
+        'break_hours': [break_hours.start, break_hours.stop],
+        'solve_mode': settings.solve_mode,
+        'random_seed': settings.random_seed
+    }
+    if grid is not None:
+        solve_input['grid'] = asdict(grid)
+    canonical = json.dumps(solve_input, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+solution_cache = SolutionCache(solution_cache_size, solution_cache_path)
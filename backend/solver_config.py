@@ -0,0 +1,189 @@
+import os
+from dataclasses import dataclass, asdict, replace
+
+
+# CP-SAT settings, set per deployment through the environment and overridable per request
+@dataclass(frozen=True)
+class SolverSettings:
+    # Seconds a single solve may run for, None for no limit
+    max_time: float = None
+    # Parallel search workers used by CP-SAT, 0 lets CP-SAT decide. The interval model uses at
+    # least ROTA_INTERVAL_MIN_WORKERS instead when a single solver process runs the solves, and
+    # ranges solved on several processes use 1, see interval_model.py and scheduler.py
+    num_search_workers: int = 0
+    # Seed for CP-SAT's search, with a single search worker runs are reproducible
+    random_seed: int = None
+    # Stop as soon as any valid rota is found instead of proving the objective
+    stop_at_first_feasible: bool = False
+    # 'exact', 'decomposed' (see symmetry.py), 'interval' (see interval_model.py) or 'week',
+    # solving each floor a week at a time when a date range is generated (see solve_floor_week)
+    solve_mode: str = 'exact'
+
+    # Apply the settings to a CpSolver
+    def apply(self, solver):
+        if self.max_time is not None:
+            solver.parameters.max_time_in_seconds = self.max_time
+        solver.parameters.num_search_workers = self.num_search_workers
+        if self.random_seed is not None:
+            solver.parameters.random_seed = self.random_seed
+        if self.stop_at_first_feasible:
+            solver.parameters.stop_after_first_solution = True
+
+    # Copy of the settings with the fields of a request's 'Solver' object applied, raises
+    # ValueError for unknown fields or invalid values
+    def with_overrides(self, overrides):
+        fields = {
+            'MaxTime': ('max_time', float),
+            'NumSearchWorkers': ('num_search_workers', int),
+            'RandomSeed': ('random_seed', int),
+            'StopAtFirstFeasible': ('stop_at_first_feasible', parse_flag),
+            'SolveMode': ('solve_mode', str)
+        }
+        unknown = [key for key in overrides if key not in fields]
+        if unknown:
+            raise ValueError(f'Unknown solver settings: {", ".join(unknown)}')
+        changes = {}
+        for key, value in overrides.items():
+            name, cast = fields[key]
+            changes[name] = None if value is None else cast(value)
+        settings = replace(self, **changes)
+        settings.validate()
+        return settings
+
+    def validate(self):
+        if self.max_time is not None and self.max_time <= 0:
+            raise ValueError('MaxTime must be positive')
+        if self.num_search_workers < 0:
+            raise ValueError('NumSearchWorkers cannot be negative')
+        if self.solve_mode not in ('exact', 'decomposed', 'interval', 'week'):
+            raise ValueError(f'Unknown solve mode: {self.solve_mode}')
+
+    @classmethod
+    def from_env(cls):
+        max_time = os.getenv('ROTA_SOLVER_MAX_TIME')
+        random_seed = os.getenv('ROTA_SOLVER_SEED')
+        settings = cls(
+            max_time=float(max_time) if max_time else None,
+            num_search_workers=int(os.getenv('ROTA_SOLVER_WORKERS', '0')),
+            random_seed=int(random_seed) if random_seed else None,
+            stop_at_first_feasible=parse_flag(os.getenv('ROTA_SOLVER_STOP_AT_FIRST', 'false')),
+            solve_mode=os.getenv('ROTA_SOLVE_MODE', 'exact')
+        )
+        settings.validate()
+        return settings
+
+
+# Working day of the interval model in minutes after midnight, set per deployment
+@dataclass(frozen=True)
+class SlotGrid:
+    day_start: int = 9 * 60
+    day_end: int = 17 * 60
+    # Length of a rota slot, every other time must be a multiple of it
+    slot_minutes: int = 60
+    # Breaks are taken within the break window
+    break_start: int = 11 * 60
+    break_end: int = 15 * 60
+    break_minutes: int = 60
+
+    # Start minute of every slot of the day
+    def slots(self):
+        return range(self.day_start, self.day_end, self.slot_minutes)
+
+    # Number of slots in a stretch of minutes
+    def to_slots(self, minutes):
+        return minutes // self.slot_minutes
+
+    def validate(self):
+        if self.slot_minutes <= 0:
+            raise ValueError('Slot length must be positive')
+        times = [self.day_start, self.day_end, self.break_start, self.break_end, self.break_minutes]
+        if any(minutes % self.slot_minutes for minutes in times):
+            raise ValueError(f'Rota times must be multiples of the {self.slot_minutes} minute slot')
+        if not self.day_start < self.day_end <= 24 * 60:
+            raise ValueError('The rota day must end after it starts and within the day')
+        if not self.day_start <= self.break_start < self.break_end <= self.day_end:
+            raise ValueError('The break window must fall within the rota day')
+        if not 0 < self.break_minutes <= self.break_end - self.break_start:
+            raise ValueError('The break must fit in the break window')
+
+    @classmethod
+    def from_env(cls):
+        grid = cls(
+            day_start=parse_time(os.getenv('ROTA_DAY_START', '9:00')),
+            day_end=parse_time(os.getenv('ROTA_DAY_END', '17:00')),
+            slot_minutes=int(os.getenv('ROTA_SLOT_MINUTES', '60')),
+            break_start=parse_time(os.getenv('ROTA_BREAK_START', '11:00')),
+            break_end=parse_time(os.getenv('ROTA_BREAK_END', '15:00')),
+            break_minutes=int(os.getenv('ROTA_BREAK_MINUTES', '60'))
+        )
+        grid.validate()
+        return grid
+
+
+# 'H:MM' to minutes after midnight, '24:00' is allowed for the end of the day
+def parse_time(value):
+    hours, _, minutes = value.partition(':')
+    return int(hours) * 60 + int(minutes or 0)
+
+
+# Minutes after midnight to the 'H:MM' used in the rota's Start Time and End Time
+def format_time(minutes):
+    return f'{minutes // 60}:{minutes % 60:02d}'
+
+
+def parse_flag(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+# Outcome of solving one floor for one day
+@dataclass
+class SolveStats:
+    date: str
+    floor: str
+    solve_mode: str
+    status: str
+    employees: int
+    build_time: float = 0.0
+    wall_time: float = 0.0
+    extract_time: float = 0.0
+    branches: int = 0
+    conflicts: int = 0
+    objective: float = None
+    # True when the rota came from the solution cache instead of a new solve
+    cached: bool = False
+    # Structured reasons the floor could not be staffed, see feasibility.py and diagnose_floor
+    infeasibility: list = None
+    # Size of the last model solved
+    variables: int = 0
+    constraints: int = 0
+
+    def is_solved(self):
+        return self.status in ('OPTIMAL', 'FEASIBLE')
+
+    # Add the statistics of a finished CpSolver run of the model
+    def record_solver(self, solver, status, model):
+        proto = model.Proto()
+        self.variables = len(proto.variables)
+        self.constraints = len(proto.constraints)
+        self.status = solver.StatusName(status)
+        self.wall_time += solver.WallTime()
+        self.branches += solver.NumBranches()
+        self.conflicts += solver.NumConflicts()
+        if self.is_solved():
+            self.objective = solver.ObjectiveValue()
+
+    def to_dict(self):
+        return asdict(self)
+
+
+# Records for one floor and day together with how they were solved
+@dataclass
+class FloorRota:
+    records: list
+    stats: SolveStats
+
+
+default_solver_settings = SolverSettings.from_env()
+default_slot_grid = SlotGrid.from_env()
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Floor solves run in a long-lived solver process that is started on the first solve and then
+# shared by every request of the web process. Only the solver process imports floor_model and
+# with it OR-Tools, so web processes that only serve reads start fast and stay small.
+
+# Solver processes kept warm, 0 solves in the calling process instead. Defaults to one per job
+# worker so concurrent generation jobs do not queue behind each other's solves
+solver_processes = int(os.getenv('ROTA_SOLVER_PROCESSES', os.getenv('ROTA_JOB_WORKERS', '1')))
+# Solver processes kept warm for the re-solves of time-off requests, which a client waits on.
+# They are separate from the job solver processes so a request never queues behind a range job
+interactive_solver_processes = int(os.getenv('ROTA_INTERACTIVE_SOLVER_PROCESSES', '1' if solver_processes else '0'))
+
+# Solver processes are started from job threads while the web, job and saver threads run, and
+# forking a process with running threads can copy locks that are held. They are forked from a
+# single-threaded fork server instead
+solver_context = multiprocessing.get_context('forkserver')
+
+
+class SolverService:
+    def __init__(self, processes):
+        self.processes = processes
+        self.executor = None
+        self.lock = threading.Lock()
+
+    # Run the named floor_model function in the solver process, returns a Future of its result
+    def submit(self, name, *args):
+        if not self.processes:
+            future = Future()
+            try:
+                future.set_result(run_solver(name, *args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = solver_pool(self.processes)
+            try:
+                return self.executor.submit(run_solver, name, *args)
+            except BrokenProcessPool:
+                # A solver process died, start a fresh pool for this and later solves
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = solver_pool(self.processes)
+                return self.executor.submit(run_solver, name, *args)
+
+    def solve(self, name, *args):
+        return self.submit(name, *args).result()
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+# Pool of solver processes, also used for the per-call pools of parallel date range runs
+def solver_pool(processes):
+    return ProcessPoolExecutor(max_workers=processes, mp_context=solver_context, initializer=warm_up)
+
+# Load OR-Tools and the models when a solver process starts rather than on its first solve
+def warm_up():
+    import floor_model
+
+def run_solver(name, *args):
+    import floor_model
+    return getattr(floor_model, name)(*args)
+
+
+solver_service = SolverService(solver_processes)
+interactive_solver_service = SolverService(interactive_solver_processes)
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+from storage import Storage, ROTA_FIELDS, sqlite_path
+
+# Storage backend keeping the Airtable tables in a local SQLite file. The rota is indexed on
+# (Date) and (Date, Employee ID), and the changes to a day are written in one transaction,
+# so saving a rota is not limited by Airtable's request rate or batch size.
+#
+# A new database has no staff, floors or tasks. Copy them from the Airtable base with
+#     python sqlite_storage.py --from-airtable
+# which reads AIRTABLE_KEY and writes to ROTA_SQLITE_PATH, or --path.
+
+# Airtable tables copied by --from-airtable, the rota is not copied and is generated again
+IMPORTED_TABLES = ['Employee', 'Floors', 'Tasks', 'Unavailability']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS employees (
+    employee_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    default_floor TEXT,
+    tasks TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS floors (
+    floor TEXT PRIMARY KEY,
+    tasks_list TEXT NOT NULL,
+    total_employees_required INTEGER
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    task TEXT PRIMARY KEY,
+    employees_required INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS unavailability (
+    id INTEGER PRIMARY KEY,
+    employee_id INTEGER NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS unavailability_dates ON unavailability (start_date, end_date);
+CREATE TABLE IF NOT EXISTS rota (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    employee_id INTEGER NOT NULL,
+    employee_name TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    floor TEXT,
+    task TEXT
+);
+CREATE INDEX IF NOT EXISTS rota_date ON rota (date);
+CREATE INDEX IF NOT EXISTS rota_date_employee ON rota (date, employee_id);
+'''
+
+# Rota columns in the order of ROTA_FIELDS
+ROTA_COLUMNS = ['date', 'employee_id', 'employee_name', 'start_time', 'end_time', 'floor', 'task']
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    # SQLite connections cannot be shared between threads or with forked processes, so each
+    # thread of each process opens its own
+    def db(self):
+        key = (os.getpid(), self.path)
+        if getattr(self.local, 'key', None) != key:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.key = key
+        return self.local.connection
+
+    def get_employee_data(self):
+        rows = self.db().execute('SELECT employee_id, name, default_floor, tasks FROM employees')
+        return {
+            employee_id: {'Name': name, 'DefaultFloor': default_floor, 'Tasks': json.loads(tasks)}
+            for employee_id, name, default_floor, tasks in rows
+        }
+
+    def get_floor_data(self):
+        rows = self.db().execute('SELECT floor, tasks_list, total_employees_required FROM floors')
+        return {
+            floor: {'Tasks List': json.loads(tasks_list), 'Total Employees Required': total}
+            for floor, tasks_list, total in rows
+        }
+
+    def get_task_data(self):
+        rows = self.db().execute('SELECT task, employees_required FROM tasks')
+        return {task: {'Employees Required': required} for task, required in rows}
+
+    def get_unavailability_data(self, date):
+        rows = self.db().execute(
+            'SELECT employee_id, start_date, end_date FROM unavailability WHERE start_date <= ? AND end_date >= ?',
+            (str(date), str(date))
+        )
+        unavailability_data = {}
+        for employee_id, start_date, end_date in rows:
+            unavailability_data.setdefault(employee_id, []).append({'Start Date': start_date, 'End Date': end_date})
+        return unavailability_data
+
+    def get_unavailability_for_range(self, start_date, end_date):
+        rows = self.db().execute(
+            'SELECT employee_id, start_date, end_date FROM unavailability WHERE start_date <= ? AND end_date >= ?',
+            (str(end_date), str(start_date))
+        )
+        return [
+            {'Employee ID': employee_id, 'Start Date': start, 'End Date': end}
+            for employee_id, start, end in rows
+        ]
+
+    def add_time_off_bulk(self, periods):
+        with self.db() as db:
+            db.executemany(
+                'INSERT INTO unavailability (employee_id, start_date, end_date) VALUES (?, ?, ?)',
+                [(employee_id, str(start_date), str(end_date)) for employee_id, start_date, end_date in periods]
+            )
+
+    def get_dates_w_rota_in_range(self, start_date, end_date):
+        rows = self.db().execute('SELECT DISTINCT date FROM rota WHERE date BETWEEN ? AND ?',
+                                 (str(start_date), str(end_date)))
+        return {date for date, in rows}
+
+    def iter_rota_in_range(self, start_date, end_date, employee_id=None, floor=None):
+        query = f'SELECT {", ".join(ROTA_COLUMNS)} FROM rota WHERE date BETWEEN ? AND ?'
+        params = [str(start_date), str(end_date)]
+        if employee_id is not None:
+            query += ' AND employee_id = ?'
+            params.append(int(employee_id))
+        if floor is not None:
+            query += ' AND floor = ?'
+            params.append(floor)
+        # Start times are H:MM, the hour is compared as a number so 9:00 comes before 10:00
+        query += ' ORDER BY date, floor, employee_id, CAST(start_time AS INTEGER), start_time, id'
+        for row in self.db().execute(query, params):
+            yield dict(zip(ROTA_FIELDS, row))
+
+    def get_rota_records_for_day(self, date):
+        rows = self.db().execute(f'SELECT id, {", ".join(ROTA_COLUMNS)} FROM rota WHERE date = ? ORDER BY id',
+                                 (str(date),))
+        return [rota_record(row) for row in rows]
+
+    # One transaction for the whole day, a failed save leaves the stored rota as it was
+    def save_rota_changes(self, updates, creates, deletes):
+        assignments = ', '.join(f'{column} = ?' for column in ROTA_COLUMNS)
+        with self.db() as db:
+            updated = []
+            for record in updates:
+                fields = self.stored_fields(db, record)
+                db.execute(f'UPDATE rota SET {assignments} WHERE id = ?', rota_values(fields) + [record['id']])
+                updated.append({'id': record['id'], 'fields': fields})
+
+            created = []
+            for record in creates:
+                cursor = db.execute(
+                    f'INSERT INTO rota ({", ".join(ROTA_COLUMNS)}) VALUES ({", ".join("?" * len(ROTA_COLUMNS))})',
+                    rota_values(record['fields'])
+                )
+                created.append({'id': cursor.lastrowid, 'fields': dict(record['fields'])})
+
+            db.executemany('DELETE FROM rota WHERE id = ?', [(record_id,) for record_id in deletes])
+        return updated, created
+
+    # Fields of the record after the update, like a PATCH only the given fields change
+    def stored_fields(self, db, record):
+        row = db.execute(f'SELECT id, {", ".join(ROTA_COLUMNS)} FROM rota WHERE id = ?', (record['id'],)).fetchone()
+        if row is None:
+            raise KeyError(f"Rota record {record['id']} does not exist")
+        fields = rota_record(row)['fields']
+        fields.update(record['fields'])
+        return fields
+
+    # Replace the reference tables and holidays with Airtable shaped rows, as returned by
+    # synthetic_data.generate_workforce or read_airtable_tables
+    def import_tables(self, tables):
+        with self.db() as db:
+            if 'Employee' in tables:
+                db.execute('DELETE FROM employees')
+                db.executemany('INSERT INTO employees VALUES (?, ?, ?, ?)', [
+                    (row['EmployeeId'], row['Name'], row.get('DefaultFloor'), json.dumps(row.get('Tasks', [])))
+                    for row in tables['Employee']
+                ])
+            if 'Floors' in tables:
+                db.execute('DELETE FROM floors')
+                db.executemany('INSERT INTO floors VALUES (?, ?, ?)', [
+                    (row['Floor'], json.dumps(row.get('Tasks List', [])), row.get('Total Employees Required'))
+                    for row in tables['Floors']
+                ])
+            if 'Tasks' in tables:
+                db.execute('DELETE FROM tasks')
+                db.executemany('INSERT INTO tasks VALUES (?, ?)', [
+                    (row['Task'], row['Employees Required']) for row in tables['Tasks']
+                ])
+            if 'Unavailability' in tables:
+                db.execute('DELETE FROM unavailability')
+                db.executemany('INSERT INTO unavailability (employee_id, start_date, end_date) VALUES (?, ?, ?)', [
+                    (row['Employee ID'], row['Holiday Start Date'], row['Holiday End Date'])
+                    for row in tables['Unavailability']
+                ])
+
+    def count_rota_records(self):
+        return self.db().execute('SELECT COUNT(*) FROM rota').fetchone()[0]
+
+
+# Read the fields of every record of the imported tables from the Airtable base
+def read_airtable_tables():
+    import airtable
+    urls = {
+        'Employee': airtable.employee_tbl_url,
+        'Floors': airtable.floors_tbl_url,
+        'Tasks': airtable.tasks_tbl_url,
+        'Unavailability': airtable.unavailability_tbl_url
+    }
+    return {table: [record['fields'] for record in airtable.client.iter_records(urls[table])] for table in IMPORTED_TABLES}
+
+def rota_record(row):
+    return {'id': row[0], 'fields': dict(zip(ROTA_FIELDS, row[1:]))}
+
+def rota_values(fields):
+    return [fields.get(field) for field in ROTA_FIELDS]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill the SQLite rota database.')
+    parser.add_argument('--from-airtable', action='store_true',
+                        help='Replace the Employee, Floors, Tasks and Unavailability tables with the Airtable base\'s')
+    parser.add_argument('--path', default=sqlite_path, help='SQLite database file')
+    args = parser.parse_args()
+    if not args.from_airtable:
+        parser.error('nothing to do, use --from-airtable')
+
+    print(f'---------Importing {", ".join(IMPORTED_TABLES)} from Airtable into {args.path}------------------')
+    tables = read_airtable_tables()
+    SQLiteStorage(args.path).import_tables(tables)
+    print(f'---------Imported {", ".join(f"{len(tables[table])} {table}" for table in IMPORTED_TABLES)}------------------')
@@ -0,0 +1,140 @@
+import os
+from abc import ABC, abstractmethod
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+# The data store the app reads reference data and holidays from and saves rotas to. Airtable
+# is the default, ROTA_STORAGE=sqlite keeps everything in a local SQLite file instead, see
+# sqlite_storage.py. The backend's module is only imported when it is selected, so an SQLite
+# deployment does not need the Airtable client's dependencies.
+
+if load_dotenv:
+    load_dotenv()
+
+# 'airtable' or 'sqlite'
+storage_backend = os.getenv('ROTA_STORAGE', 'airtable')
+# SQLite database file used by the sqlite backend
+sqlite_path = os.getenv('ROTA_SQLITE_PATH', 'rota.db')
+
+# Fields of a rota row in the order they are returned to clients
+ROTA_FIELDS = ['Date', 'Employee ID', 'Employee Name', 'Start Time', 'End Time', 'Floor', 'Task']
+
+
+# Operations the scheduler, persistence and app.py use. A backend missing any of them fails when
+# it is created. Records are in Airtable's shape, {'id': record id, 'fields': {field: value}},
+# whatever the backend
+class Storage(ABC):
+    # {employee id: {'Name', 'DefaultFloor', 'Tasks'}}
+    @abstractmethod
+    def get_employee_data(self):
+        ...
+
+    # {floor: {'Tasks List', 'Total Employees Required'}}
+    @abstractmethod
+    def get_floor_data(self):
+        ...
+
+    # {task: {'Employees Required'}}
+    @abstractmethod
+    def get_task_data(self):
+        ...
+
+    # {employee id: [{'Start Date', 'End Date'}, ...]} for the employees on holiday on the date
+    @abstractmethod
+    def get_unavailability_data(self, date):
+        ...
+
+    # [{'Employee ID', 'Start Date', 'End Date'}, ...] for the holidays overlapping the range
+    @abstractmethod
+    def get_unavailability_for_range(self, start_date, end_date):
+        ...
+
+    def add_time_off(self, employee_id, start_date, end_date):
+        self.add_time_off_bulk([(employee_id, start_date, end_date)])
+
+    # Add (employee id, start date, end date) periods of time off
+    @abstractmethod
+    def add_time_off_bulk(self, periods):
+        ...
+
+    # Set of the dates with a stored rota between the start and end dates
+    @abstractmethod
+    def get_dates_w_rota_in_range(self, start_date, end_date):
+        ...
+
+    # Yield the rota rows between the dates as dicts of ROTA_FIELDS, ordered by date, floor,
+    # employee and start time
+    @abstractmethod
+    def iter_rota_in_range(self, start_date, end_date, employee_id=None, floor=None):
+        ...
+
+    # The day's stored rota records including their record ids
+    @abstractmethod
+    def get_rota_records_for_day(self, date):
+        ...
+
+    # Apply the updates ({'id', 'fields'}), creates ({'fields'}) and deletes (record ids) of a
+    # day's rota, returns the updated and the created records
+    @abstractmethod
+    def save_rota_changes(self, updates, creates, deletes):
+        ...
+
+
+class AirtableStorage(Storage):
+    def __init__(self):
+        import airtable
+        self.airtable = airtable
+
+    def get_employee_data(self):
+        return self.airtable.get_employee_data()
+
+    def get_floor_data(self):
+        return self.airtable.get_floor_data()
+
+    def get_task_data(self):
+        return self.airtable.get_task_data()
+
+    def get_unavailability_data(self, date):
+        return self.airtable.get_unavailability_data(date)
+
+    def get_unavailability_for_range(self, start_date, end_date):
+        return self.airtable.get_unavailability_for_range(start_date, end_date)
+
+    def add_time_off_bulk(self, periods):
+        self.airtable.add_time_off_bulk(periods)
+
+    def get_dates_w_rota_in_range(self, start_date, end_date):
+        return self.airtable.get_dates_w_rota_in_range(start_date, end_date)
+
+    def iter_rota_in_range(self, start_date, end_date, employee_id=None, floor=None):
+        return self.airtable.iter_rota_in_range(start_date, end_date, employee_id, floor)
+
+    def get_rota_records_for_day(self, date):
+        return self.airtable.get_rota_records_for_day(date)
+
+    # Airtable has no transactions, the batches are sent one after another
+    def save_rota_changes(self, updates, creates, deletes):
+        updated = self.airtable.update_rota_records(updates)
+        created = self.airtable.write_to_rota_table(creates)
+        self.airtable.delete_rota_records(deletes)
+        return updated, created
+
+
+# Sort key of a rota record's fields by start time, 'Start Time' is H:MM so it does not sort as text
+def start_hour(fields):
+    hour, _, minute = fields['Start Time'].partition(':')
+    return int(hour), int(minute or 0)
+
+def load_storage(backend):
+    if backend == 'airtable':
+        return AirtableStorage()
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(sqlite_path)
+    raise ValueError(f'Unknown storage backend: {backend}')
+
+
+storage = load_storage(storage_backend)
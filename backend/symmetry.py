@@ -0,0 +1,166 @@
+from ortools.sat.python import cp_model
+
+# Two stage solve that treats employees with the same tasks as interchangeable.
+# Stage 1 solves how many employees of each class work each task every hour and how
+# many of them go on break, stage 2 hands those counts out to the actual employees.
+
+
+# Group the floor's employees by the floor tasks they can do
+def employee_classes(employees, floor_data):
+    classes = {}
+    for e in employees:
+        tasks = tuple(task for task in floor_data['Tasks List'] if task in employees[e]['Tasks'])
+        classes.setdefault(tasks, []).append(e)
+    return classes
+
+# Solve the floor and return the cp_model status of the count model together with the
+# task for every (employee, hour), which is None if the counts could not be handed out.
+# The count model's solver statistics are added to stats
+def solve_decomposed(employees, floor_data, task_data, hours, break_hours, settings, stats):
+    classes = employee_classes(employees, floor_data)
+    status, counts, break_counts = solve_class_counts(classes, floor_data, task_data, hours, break_hours, settings, stats)
+    if status != cp_model.OPTIMAL and status != cp_model.FEASIBLE:
+        return status, None
+
+    assignment = {}
+    for tasks, members in classes.items():
+        class_assignment = assign_class(members, tasks, counts[tasks], break_counts[tasks], hours, break_hours)
+        if class_assignment is None:
+            return status, None
+        assignment.update(class_assignment)
+    return status, assignment
+
+# Stage 1: headcount per class, hour and task plus break placement as integer variables
+def solve_class_counts(classes, floor_data, task_data, hours, break_hours, settings, stats):
+    model = cp_model.CpModel()
+
+    counts = {}
+    break_counts = {}
+    for c, (tasks, members) in enumerate(classes.items()):
+        size = len(members)
+        counts[tasks] = {(t, task): model.NewIntVar(0, size, f'count_{c}_{t}_{task}') for t in hours for task in tasks}
+        break_counts[tasks] = {t: model.NewIntVar(0, size, f'breaks_{c}_{t}') for t in break_hours}
+
+        # Every member takes exactly one break
+        model.Add(sum(break_counts[tasks].values()) == size)
+
+        # Members work at most one task per hour and nothing while on break
+        for t in hours:
+            on_break = break_counts[tasks][t] if t in break_hours else 0
+            model.Add(sum(counts[tasks][(t, task)] for task in tasks) + on_break <= size)
+
+        # Each member works a task at most 2 hours in any 3, so the class does at most 2 * size
+        for task in tasks:
+            for start_time in range(hours.start, hours.stop - 2):
+                model.Add(sum(counts[tasks][(t, task)] for t in range(start_time, start_time + 3)) <= 2 * size)
+
+    # All tasks on the floor have the required number of employees every hour
+    for task in floor_data['Tasks List']:
+        for t in hours:
+            model.Add(sum(counts[tasks][(t, task)] for tasks in classes if task in tasks) ==
+                      task_data[task]['Employees Required'])
+
+    solver = cp_model.CpSolver()
+    settings.apply(solver)
+    status = solver.Solve(model)
+    stats.record_solver(solver, status, model)
+    if status != cp_model.OPTIMAL and status != cp_model.FEASIBLE:
+        return status, None, None
+
+    counts = {tasks: {key: solver.Value(var) for key, var in class_counts.items()} for tasks, class_counts in counts.items()}
+    break_counts = {tasks: {t: solver.Value(var) for t, var in class_breaks.items()} for tasks, class_breaks in break_counts.items()}
+    return status, counts, break_counts
+
+# Stage 2: hand out one class's counts hour by hour, never giving an employee the same task for
+# a third hour in a row. Within the hour employees in the same state (task last hour, task they
+# are barred from, still owed a break) are interchangeable, so the hour is a small transportation
+# problem from states to tasks that avoids keeping employees on the task they just did.
+# Returns None if the counts cannot be handed out
+def assign_class(members, tasks, counts, break_counts, hours, break_hours):
+    assignment = {}
+    had_break = set()
+    for t in hours:
+        states = {}
+        for e in members:
+            previous = assignment.get((e, t - 1))
+            barred = previous if previous in tasks and assignment.get((e, t - 2)) == previous else None
+            states.setdefault((previous, barred, e not in had_break), []).append(e)
+
+        slots = {task: counts[(t, task)] for task in tasks}
+        slots['Break'] = break_counts[t] if t in break_hours else 0
+        slots['Roaming'] = len(members) - sum(slots.values())
+
+        def cost(state, slot):
+            previous, barred, owed_break = state
+            if slot == barred or (slot == 'Break' and not owed_break):
+                return None
+            # Repeating a task is allowed but may bar the employee from it next hour
+            return 1 if slot == previous and slot in tasks else 0
+
+        flow = min_cost_flow({state: len(group) for state, group in states.items()}, slots, cost)
+        if flow is None:
+            return None
+
+        # Hand out each state's slots in round-robin order so tasks move around the class
+        for state, group in states.items():
+            offset = t % len(group)
+            group = group[offset:] + group[:offset]
+            for slot, amount in flow[state].items():
+                for e in group[:amount]:
+                    assignment[(e, t)] = slot
+                    if slot == 'Break':
+                        had_break.add(e)
+                group = group[amount:]
+    return assignment
+
+# Send every unit of supply to a slot at the lowest total cost with successive shortest paths.
+# cost(source, slot) returns None when the source cannot use the slot. Returns
+# {source: {slot: amount}}, or None if not all supply fits
+def min_cost_flow(supply, capacity, cost):
+    flow = {source: {} for source in supply}
+    used = {slot: 0 for slot in capacity}
+    remaining = dict(supply)
+    edges = {(source, slot): c for source in supply for slot in capacity
+             if capacity[slot] and (c := cost(source, slot)) is not None}
+
+    while any(remaining.values()):
+        # Bellman-Ford over the residual graph: sources with supply left -> slots -> sources already using them
+        dist = {('source', source): 0 for source in supply if remaining[source]}
+        prev = {}
+        for _ in range(len(supply) + len(capacity)):
+            changed = False
+            for (source, slot), c in edges.items():
+                # Forward edge, source takes one more unit of the slot
+                if ('source', source) in dist:
+                    d = dist[('source', source)] + c
+                    if d < dist.get(('slot', slot), float('inf')):
+                        dist[('slot', slot)] = d
+                        prev[('slot', slot)] = ('source', source)
+                        changed = True
+                # Backward edge, a source using the slot gives up one unit
+                if flow[source].get(slot) and ('slot', slot) in dist:
+                    d = dist[('slot', slot)] - c
+                    if d < dist.get(('source', source), float('inf')):
+                        dist[('source', source)] = d
+                        prev[('source', source)] = ('slot', slot)
+                        changed = True
+            if not changed:
+                break
+
+        free = [slot for slot in capacity if used[slot] < capacity[slot] and ('slot', slot) in dist]
+        if not free:
+            return None
+        end = min(free, key=lambda slot: dist[('slot', slot)])
+
+        # Walk the path back to a source with supply left and push one unit along it
+        node = ('slot', end)
+        used[end] += 1
+        while node in prev:
+            parent = prev[node]
+            if node[0] == 'slot':
+                flow[parent[1]][node[1]] = flow[parent[1]].get(node[1], 0) + 1
+            else:
+                flow[node[1]][parent[1]] -= 1
+            node = parent
+        remaining[node[1]] -= 1
+    return flow
@@ -0,0 +1,65 @@
+import random
+from datetime import timedelta
+
+# Synthetic Employee, Floors, Tasks and Unavailability tables in the shape Airtable returns their
+# fields, sized so every floor can be staffed under the rota rules
+
+
+# Generate the tables for num_employees staff, returns {table name: [fields, ...]}
+def generate_workforce(num_employees, start_date, days, employees_per_floor=40, seed=0):
+    rng = random.Random(seed)
+
+    # A shared pool of tasks, each floor runs a handful of them
+    tasks = {f'Task {i}': rng.randint(1, 3) for i in range(1, 21)}
+
+    num_floors = max(1, round(num_employees / employees_per_floor))
+    floor_sizes = [num_employees // num_floors] * num_floors
+    for i in range(num_employees % num_floors):
+        floor_sizes[i] += 1
+
+    floors = []
+    employees = []
+    employee_id = 0
+    for f, size in enumerate(floor_sizes):
+        floor = f'Floor {f + 1}'
+        # Keep the staffing need at no more than about half of the floor so it stays feasible with
+        # breaks, holidays and the 2 hour rule
+        floor_tasks = []
+        for task in rng.sample(sorted(tasks), rng.randint(2, 4)):
+            if sum(tasks[t] for t in floor_tasks) + tasks[task] <= max(1, size // 2 - 1):
+                floor_tasks.append(task)
+        floors.append({
+            'Floor': floor,
+            'Tasks List': floor_tasks,
+            'Total Employees Required': sum(tasks[task] for task in floor_tasks)
+        })
+
+        for _ in range(size):
+            employee_id += 1
+            # Most staff can cover most of their floor's tasks, some also know other tasks
+            skills = [task for task in floor_tasks if rng.random() < 0.8] or floor_tasks[:1]
+            skills += rng.sample(sorted(tasks), 1)
+            employees.append({
+                'EmployeeId': employee_id,
+                'Name': f'Employee {employee_id}',
+                'DefaultFloor': floor,
+                'Tasks': sorted(set(skills))
+            })
+
+    # Around 5% of staff have a holiday somewhere in the range
+    unavailability = []
+    for employee in rng.sample(employees, len(employees) // 20):
+        start = start_date + timedelta(days=rng.randrange(days))
+        unavailability.append({
+            'Employee ID': employee['EmployeeId'],
+            'Holiday Start Date': start.isoformat(),
+            'Holiday End Date': (start + timedelta(days=rng.randint(0, 4))).isoformat()
+        })
+
+    return {
+        'Employee': employees,
+        'Floors': floors,
+        'Tasks': [{'Task': task, 'Employees Required': required} for task, required in tasks.items()],
+        'Unavailability': unavailability
+    }
+
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The backend modules import each other by name from the backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules that import storage get a throwaway SQLite file rather than the Airtable base
+os.environ.setdefault('ROTA_STORAGE', 'sqlite')
+os.environ.setdefault('ROTA_SQLITE_PATH', os.path.join(tempfile.mkdtemp(), 'test.db'))
@@ -0,0 +1,95 @@
+import random
+
+from ortools.sat.python import cp_model
+
+from feasibility import check_floor_capacity
+from floor_model import build_floor_model
+from rota_table import HOURS, BREAK_HOURS
+
+
+def floor(tasks):
+    return {'Tasks List': list(tasks), 'Total Employees Required': None}
+
+
+def staff(*task_lists):
+    return {e: {'Name': f'Employee {e}', 'Tasks': list(tasks)} for e, tasks in enumerate(task_lists, start=1)}
+
+
+def checks(employees, floor_data, task_data, **kwargs):
+    return [reason['check'] for reason in check_floor_capacity(employees, floor_data, task_data, HOURS, BREAK_HOURS, **kwargs)]
+
+
+def test_staffable_floor_passes():
+    employees = staff(['A'], ['A'], ['A'], ['B'], ['B'], ['B'])
+    task_data = {'A': {'Employees Required': 1}, 'B': {'Employees Required': 1}}
+
+    assert checks(employees, floor(['A', 'B']), task_data) == []
+
+
+def test_too_few_qualified_employees():
+    employees = staff(['A'], ['B'], ['B'])
+    reasons = check_floor_capacity(employees, floor(['A', 'B']), {'A': {'Employees Required': 2}, 'B': {'Employees Required': 0}},
+                                   HOURS, BREAK_HOURS)
+
+    assert [reason['check'] for reason in reasons] == ['qualified_headcount']
+    assert reasons[0]['task'] == 'A'
+    assert (reasons[0]['required'], reasons[0]['available']) == (2, 1)
+
+
+def test_rotation_under_the_two_hour_rule():
+    # Two employees give at most 4 of every 3 consecutive hours' 6 assignments
+    employees = staff(['A'], ['A'], [], [], [])
+
+    assert checks(employees, floor(['A']), {'A': {'Employees Required': 2}}) == ['rotation']
+
+
+def test_rotation_window_grows_with_the_gap_between_runs():
+    # On 30 minute slots three employees running 4 slots each cover 2 a slot with 2 slots
+    # between runs, but not with 3
+    employees = staff(['A'], ['A'], ['A'], [], [], [])
+    task_data = {'A': {'Employees Required': 2}}
+    slots = range(16)
+    break_slots = range(4, 12)
+
+    assert check_floor_capacity(employees, floor(['A']), task_data, slots, break_slots, max_run=4, break_length=2,
+                                min_gap=2) == []
+    reasons = check_floor_capacity(employees, floor(['A']), task_data, slots, break_slots, max_run=4, break_length=2,
+                                   min_gap=3)
+    assert [reason['check'] for reason in reasons] == ['rotation']
+
+
+def test_break_cover_of_a_task():
+    # With two hour breaks three employees cover 6 of the 8 assignments the break hours need
+    employees = staff(['A'], ['A'], ['A'], [], [], [])
+    task_data = {'A': {'Employees Required': 2}}
+
+    assert checks(employees, floor(['A']), task_data) == []
+    assert checks(employees, floor(['A']), task_data, break_length=2) == ['break_cover']
+
+
+def test_floor_headcount_and_break_cover():
+    employees = staff(['A', 'B'], ['A', 'B'], ['A', 'B'])
+    task_data = {'A': {'Employees Required': 2}, 'B': {'Employees Required': 2}}
+    assert 'floor_headcount' in checks(employees, floor(['A', 'B']), task_data)
+
+    # Every hour needs everyone, so nobody can take a break
+    employees = staff(['A', 'B'], ['A', 'B'], ['A', 'B'], ['A', 'B'])
+    assert checks(employees, floor(['A', 'B']), task_data) == ['floor_break_cover']
+
+
+def solvable(employees, floor_data, task_data):
+    model, _, _ = build_floor_model(employees, floor_data, task_data, 'Floor')
+    solver = cp_model.CpSolver()
+    solver.parameters.num_search_workers = 1
+    solver.parameters.max_time_in_seconds = 10
+    return solver.Solve(model) in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+
+
+def test_never_rejects_a_floor_the_solver_can_staff():
+    rng = random.Random(0)
+    for _ in range(40):
+        tasks = ['A', 'B', 'C'][:rng.randint(1, 3)]
+        task_data = {task: {'Employees Required': rng.randint(0, 2)} for task in tasks}
+        employees = staff(*[[task for task in tasks if rng.random() < 0.5] for _ in range(rng.randint(1, 8))])
+        if checks(employees, floor(tasks), task_data):
+            assert not solvable(employees, floor(tasks), task_data)
@@ -0,0 +1,98 @@
+from persistence import diff_rota, save_rota_for_day
+from rota_cache import rota_cache
+from storage import storage
+
+
+def fields(employee_id, start_time, task, date='2024-01-01', floor='Floor 1'):
+    return {
+        'Date': date,
+        'Employee ID': employee_id,
+        'Employee Name': f'Employee {employee_id}',
+        'Start Time': start_time,
+        'End Time': f"{int(start_time.split(':')[0]) + 1}:00",
+        'Floor': floor,
+        'Task': task
+    }
+
+
+def stored(record_id, employee_id, start_time, task):
+    return {'id': record_id, 'fields': fields(employee_id, start_time, task)}
+
+
+def new(employee_id, start_time, task, floor='Floor 1'):
+    return {'fields': fields(employee_id, start_time, task, floor=floor)}
+
+
+def test_unchanged_rota_sends_nothing():
+    records = [stored('rec1', 1, '9:00', 'Roaming'), stored('rec2', 1, '10:00', 'Task A')]
+
+    assert diff_rota(records, [new(1, '9:00', 'Roaming'), new(1, '10:00', 'Task A')]) == ([], [], [])
+
+
+def test_changed_slot_is_updated_in_place():
+    updates, creates, deletes = diff_rota([stored('rec1', 1, '9:00', 'Roaming')], [new(1, '9:00', 'Task A')])
+
+    assert updates == [{'id': 'rec1', 'fields': fields(1, '9:00', 'Task A')}]
+    assert creates == []
+    assert deletes == []
+
+
+def test_new_slots_are_created_and_missing_slots_deleted():
+    updates, creates, deletes = diff_rota([], [new(1, '9:00', 'Roaming')])
+    assert (updates, creates, deletes) == ([], [new(1, '9:00', 'Roaming')], [])
+
+    updates, creates, deletes = diff_rota([stored('rec1', 1, '9:00', 'Roaming')], [])
+    assert (updates, creates, deletes) == ([], [], ['rec1'])
+
+
+def test_duplicate_stored_slots_are_removed():
+    records = [
+        stored('rec1', 1, '9:00', 'Roaming'),
+        stored('rec2', 1, '9:00', 'Roaming'),
+        stored('rec3', 1, '9:00', 'Task A'),
+    ]
+
+    updates, creates, deletes = diff_rota(records, [new(1, '9:00', 'Roaming')])
+
+    # The first stored record keeps the slot, the leftovers from earlier runs go
+    assert updates == []
+    assert creates == []
+    assert sorted(deletes) == ['rec2', 'rec3']
+
+
+def test_stale_records_are_reused_for_new_slots():
+    # Employee 1 left the floor and employee 2 joined it
+    records = [stored('rec1', 1, '9:00', 'Roaming'), stored('rec2', 1, '10:00', 'Task A')]
+    new_records = [new(2, '9:00', 'Task A'), new(2, '10:00', 'Break'), new(2, '11:00', 'Roaming')]
+
+    updates, creates, deletes = diff_rota(records, new_records)
+
+    # Two slots are moved onto the stale records with a PATCH each, only the third is created
+    assert updates == [
+        {'id': 'rec1', 'fields': fields(2, '9:00', 'Task A')},
+        {'id': 'rec2', 'fields': fields(2, '10:00', 'Break')},
+    ]
+    assert creates == [new(2, '11:00', 'Roaming')]
+    assert deletes == []
+
+
+def test_more_stale_records_than_new_slots():
+    records = [stored('rec1', 1, '9:00', 'Roaming'), stored('rec2', 1, '10:00', 'Roaming'), stored('rec3', 1, '11:00', 'Roaming')]
+
+    updates, creates, deletes = diff_rota(records, [new(2, '9:00', 'Task A')])
+
+    assert updates == [{'id': 'rec1', 'fields': fields(2, '9:00', 'Task A')}]
+    assert creates == []
+    assert deletes == ['rec2', 'rec3']
+
+
+def test_kept_floors_are_not_replaced():
+    date = '2024-01-01'
+    save_rota_for_day(date, [new(1, '9:00', 'Task A'), new(2, '9:00', 'Task B', floor='Floor 2')])
+
+    # Floor 2 had no rota this time, its stored records stay while Floor 1 is replaced
+    save_rota_for_day(date, [new(1, '9:00', 'Roaming')], keep_floors={'Floor 2'})
+
+    saved = sorted((record['fields']['Floor'], record['fields']['Task']) for record in storage.get_rota_records_for_day(date))
+    assert saved == [('Floor 1', 'Roaming'), ('Floor 2', 'Task B')]
+    assert sorted((row[5], row[6]) for row in rota_cache.get_rota_for_day(date)) == saved
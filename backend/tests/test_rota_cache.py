@@ -0,0 +1,149 @@
+import threading
+
+import pytest
+
+from rota_cache import RotaCache
+
+
+def record(record_id, task, start_time='9:00', date='2024-01-01'):
+    return {
+        'id': record_id,
+        'fields': {
+            'Date': date,
+            'Employee ID': 1,
+            'Employee Name': 'Employee 1',
+            'Start Time': start_time,
+            'End Time': f"{int(start_time.split(':')[0]) + 1}:00",
+            'Floor': 'Floor 1',
+            'Task': task
+        }
+    }
+
+
+# Loader returning the stored records of a date. While blocked, reads wait after taking their
+# copy of the storage until release is called, as a slow storage read would
+class BlockingLoader:
+    def __init__(self, stored):
+        self.stored = stored
+        self.calls = 0
+        self.blocked = False
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, date):
+        self.calls += 1
+        records = list(self.stored.get(date, []))
+        if self.blocked:
+            self.started.set()
+            self.released.wait(5)
+        return records
+
+    def block(self):
+        self.blocked = True
+
+    def release(self):
+        self.blocked = False
+        self.released.set()
+
+
+# Start a get_day of the date that blocks in the loader, returns a function waiting for its rows
+def read_in_flight(cache, loader, date):
+    loader.block()
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('rows', cache.get_rota_for_day(date)))
+    thread.start()
+    assert loader.started.wait(5)
+
+    def finish():
+        loader.release()
+        thread.join(5)
+        return result['rows']
+    return finish
+
+
+def tasks(rows):
+    return [row[6] for row in rows]
+
+
+@pytest.fixture
+def stored():
+    return {'2024-01-01': [record('rec1', 'Task A')], '2024-01-02': [record('rec2', 'Task A', date='2024-01-02')]}
+
+
+def test_rows_are_read_once_and_in_time_order(stored):
+    stored['2024-01-01'] = [record('rec2', 'Task B', '10:00'), record('rec1', 'Task A', '9:00')]
+    loader = BlockingLoader(stored)
+    cache = RotaCache(loader, ttl=3600, max_days=10)
+
+    assert tasks(cache.get_rota_for_day('2024-01-01')) == ['Task A', 'Task B']
+    assert tasks(cache.get_rota_for_day('2024-01-01')) == ['Task A', 'Task B']
+    assert loader.calls == 1
+
+
+def test_read_racing_put_day_is_not_cached(stored):
+    loader = BlockingLoader(stored)
+    cache = RotaCache(loader, ttl=3600, max_days=10)
+    finish = read_in_flight(cache, loader, '2024-01-01')
+
+    stored['2024-01-01'] = [record('rec1', 'Task B')]
+    cache.put_day('2024-01-01', stored['2024-01-01'])
+
+    # The read returns what it read, but the day put while it ran stays cached
+    assert tasks(finish()) == ['Task A']
+    assert tasks(cache.get_rota_for_day('2024-01-01')) == ['Task B']
+    assert loader.calls == 1
+
+
+def test_read_racing_apply_changes_is_not_cached(stored):
+    loader = BlockingLoader(stored)
+    cache = RotaCache(loader, ttl=3600, max_days=10)
+    finish = read_in_flight(cache, loader, '2024-01-01')
+
+    stored['2024-01-01'] = [record('rec1', 'Task B')]
+    cache.apply_changes('2024-01-01', updated=stored['2024-01-01'])
+
+    assert tasks(finish()) == ['Task A']
+    # The day was not cached when the change was applied, so it is read again
+    assert tasks(cache.get_rota_for_day('2024-01-01')) == ['Task B']
+    assert loader.calls == 2
+
+
+@pytest.mark.parametrize('date', ['2024-01-01', None])
+def test_read_racing_invalidate_is_not_cached(stored, date):
+    loader = BlockingLoader(stored)
+    cache = RotaCache(loader, ttl=3600, max_days=10)
+    finish = read_in_flight(cache, loader, '2024-01-01')
+
+    stored['2024-01-01'] = [record('rec1', 'Task B')]
+    cache.invalidate(date)
+
+    assert tasks(finish()) == ['Task A']
+    assert tasks(cache.get_rota_for_day('2024-01-01')) == ['Task B']
+    assert loader.calls == 2
+
+
+def test_write_to_another_day_keeps_the_read(stored):
+    loader = BlockingLoader(stored)
+    cache = RotaCache(loader, ttl=3600, max_days=10)
+    finish = read_in_flight(cache, loader, '2024-01-01')
+
+    cache.put_day('2024-01-02', [record('rec2', 'Task B', date='2024-01-02')])
+
+    assert tasks(finish()) == ['Task A']
+    assert tasks(cache.get_rota_for_day('2024-01-01')) == ['Task A']
+    assert loader.calls == 1
+
+
+def test_failed_read_is_not_cached_and_forgets_writes(stored):
+    def failing_loader(date):
+        raise OSError('storage unavailable')
+    cache = RotaCache(failing_loader, ttl=3600, max_days=10)
+
+    with pytest.raises(OSError):
+        cache.get_rota_for_day('2024-01-01')
+
+    assert cache.loading == 0
+    assert cache.days == {}
+    cache.put_day('2024-01-01', stored['2024-01-01'])
+    assert cache.written == {}
+    assert tasks(cache.get_rota_for_day('2024-01-01')) == ['Task A']
@@ -0,0 +1,47 @@
+import os
+from datetime import date
+
+import airtable
+from fake_airtable import FakeAirtable
+from sqlite_storage import SQLiteStorage, read_airtable_tables
+from synthetic_data import generate_workforce
+
+
+def fake_airtable(tables, monkeypatch):
+    base = FakeAirtable(rate_limit=None)
+    for table, rows in tables.items():
+        base.add_records(table, rows)
+    client = airtable.AirtableClient('key', rate=float('inf'))
+    client.session.mount('https://api.airtable.com/', base.adapter())
+    monkeypatch.setattr(airtable, 'client', client)
+
+
+# Rota rows of an employee's day saved with the stale record of an earlier run reused for 9:00
+def unordered_rota():
+    fields = {'Date': '2024-01-01', 'Employee ID': 1, 'Employee Name': 'Employee 1', 'Floor': 'Floor 1', 'Task': 'Roaming'}
+    return [dict(fields, **{'Start Time': f'{hour}:00', 'End Time': f'{hour + 1}:00'}) for hour in (10, 11, 9)]
+
+
+def test_import_from_airtable(tmp_path, monkeypatch):
+    # More employees than fit on one page of listRecords
+    tables = generate_workforce(120, date(2024, 1, 1), 7, seed=0)
+    fake_airtable(tables, monkeypatch)
+
+    storage = SQLiteStorage(os.path.join(tmp_path, 'rota.db'))
+    storage.import_tables(read_airtable_tables())
+
+    employees = storage.get_employee_data()
+    assert len(employees) == 120
+    assert employees[1] == {key: value for key, value in tables['Employee'][0].items() if key != 'EmployeeId'}
+    assert sorted(storage.get_floor_data()) == sorted(floor['Floor'] for floor in tables['Floors'])
+    assert len(storage.get_task_data()) == len(tables['Tasks'])
+    assert len(storage.get_unavailability_for_range('2024-01-01', '2024-01-31')) == len(tables['Unavailability'])
+
+
+def test_rota_export_is_in_time_order(tmp_path, monkeypatch):
+    storage = SQLiteStorage(os.path.join(tmp_path, 'rota.db'))
+    storage.save_rota_changes([], [{'fields': fields} for fields in unordered_rota()], [])
+    fake_airtable({'Rota': unordered_rota()}, monkeypatch)
+
+    for rows in (storage.iter_rota_in_range('2024-01-01', '2024-01-01'), airtable.iter_rota_in_range('2024-01-01', '2024-01-01')):
+        assert [row['Start Time'] for row in rows] == ['9:00', '10:00', '11:00']
@@ -0,0 +1,76 @@
+from symmetry import assign_class, min_cost_flow
+
+HOURS = range(9, 17)
+BREAK_HOURS = range(11, 15)
+
+
+def total_cost(flow, cost):
+    return sum(cost(source, slot) * amount for source in flow for slot, amount in flow[source].items())
+
+
+# Rerouted units can leave zero amounts behind
+def used_slots(flow):
+    return {source: {slot: amount for slot, amount in slots.items() if amount} for source, slots in flow.items()}
+
+
+def test_min_cost_flow_sends_every_unit_at_the_lowest_cost():
+    costs = {('a', 'x'): 1, ('a', 'y'): 0, ('b', 'x'): 0, ('b', 'y'): 1}
+    cost = lambda source, slot: costs[(source, slot)]
+
+    flow = min_cost_flow({'a': 2, 'b': 2}, {'x': 2, 'y': 2}, cost)
+
+    assert used_slots(flow) == {'a': {'y': 2}, 'b': {'x': 2}}
+    assert total_cost(flow, cost) == 0
+
+
+def test_min_cost_flow_reroutes_earlier_units():
+    # b can only use x, so a must end up on y whichever order the units are sent in
+    cost = lambda source, slot: None if (source, slot) == ('b', 'y') else 0
+
+    flow = min_cost_flow({'a': 1, 'b': 1}, {'x': 1, 'y': 1}, cost)
+
+    assert used_slots(flow) == {'a': {'y': 1}, 'b': {'x': 1}}
+
+
+def test_min_cost_flow_returns_none_when_supply_does_not_fit():
+    cost = lambda source, slot: 0
+    assert min_cost_flow({'a': 3}, {'x': 1, 'y': 1}, cost) is None
+
+    # Enough capacity overall, but not on the slots the source may use
+    cost = lambda source, slot: None if slot == 'y' else 0
+    assert min_cost_flow({'a': 2}, {'x': 1, 'y': 1}, cost) is None
+
+
+def check_class_rota(assignment, members, tasks, counts, break_counts):
+    for t in HOURS:
+        for task in tasks:
+            assert sum(assignment[(e, t)] == task for e in members) == counts[(t, task)]
+        if t in BREAK_HOURS:
+            assert sum(assignment[(e, t)] == 'Break' for e in members) == break_counts[t]
+    for e in members:
+        day = [assignment[(e, t)] for t in HOURS]
+        assert day.count('Break') == 1
+        assert all(assignment[(e, t)] != 'Break' for t in HOURS if t not in BREAK_HOURS)
+        for first, second, third in zip(day, day[1:], day[2:]):
+            assert not (first == second == third and first in tasks)
+
+
+def test_assign_class_meets_the_counts_and_rules():
+    members = [1, 2, 3, 4]
+    tasks = ['A', 'B']
+    counts = {(t, 'A'): 1 for t in HOURS}
+    counts.update({(t, 'B'): 1 if t not in BREAK_HOURS else 0 for t in HOURS})
+    break_counts = {11: 1, 12: 1, 13: 1, 14: 1}
+
+    assignment = assign_class(members, tasks, counts, break_counts, HOURS, BREAK_HOURS)
+
+    assert assignment is not None
+    check_class_rota(assignment, members, tasks, counts, break_counts)
+
+
+def test_assign_class_returns_none_when_the_counts_cannot_be_handed_out():
+    # A single employee cannot cover a task three hours in a row
+    counts = {(t, 'A'): 1 for t in HOURS}
+    break_counts = {11: 0, 12: 0, 13: 0, 14: 0}
+
+    assert assign_class([1], ['A'], counts, break_counts, HOURS, BREAK_HOURS) is None
@@ -0,0 +1,66 @@
+from datetime import date
+
+from unavailability import UnavailabilityIndex
+
+
+def period(employee_id, start_date, end_date):
+    return {'Employee ID': employee_id, 'Start Date': start_date, 'End Date': end_date}
+
+
+def test_period_includes_start_and_end_dates():
+    index = UnavailabilityIndex([period(1, '2024-01-02', '2024-01-04')])
+
+    assert index.unavailable_on('2024-01-01') == set()
+    assert index.unavailable_on('2024-01-02') == {1}
+    assert index.unavailable_on('2024-01-04') == {1}
+    assert index.unavailable_on('2024-01-05') == set()
+
+
+def test_overlapping_periods_of_one_employee():
+    index = UnavailabilityIndex([
+        period(1, '2024-01-01', '2024-01-05'),
+        period(1, '2024-01-03', '2024-01-08'),
+    ])
+
+    # The employee stays away until the later period ends, not when the first one does
+    assert index.unavailable_on('2024-01-05') == {1}
+    assert index.unavailable_on('2024-01-06') == {1}
+    assert index.unavailable_on('2024-01-08') == {1}
+    assert index.unavailable_on('2024-01-09') == set()
+
+
+def test_adjacent_periods_leave_no_gap():
+    index = UnavailabilityIndex([
+        period(1, '2024-01-01', '2024-01-03'),
+        period(1, '2024-01-04', '2024-01-06'),
+    ])
+
+    assert all(index.unavailable_on(f'2024-01-0{day}') == {1} for day in range(1, 7))
+    assert index.unavailable_on('2024-01-07') == set()
+
+
+def test_periods_of_several_employees():
+    index = UnavailabilityIndex([
+        period(1, '2024-01-01', '2024-01-03'),
+        period(2, '2024-01-03', '2024-01-04'),
+        period(3, '2024-01-10', '2024-01-10'),
+    ])
+
+    assert index.unavailable_on('2024-01-02') == {1}
+    assert index.unavailable_on('2024-01-03') == {1, 2}
+    assert index.unavailable_on('2024-01-04') == {2}
+    assert index.unavailable_on('2024-01-10') == {3}
+
+
+def test_accepts_date_objects_and_skips_reversed_periods():
+    index = UnavailabilityIndex([
+        period(1, date(2024, 1, 2), date(2024, 1, 2)),
+        period(2, '2024-01-05', '2024-01-01'),
+    ])
+
+    assert index.unavailable_on(date(2024, 1, 2)) == {1}
+    assert index.unavailable_on('2024-01-03') == set()
+
+
+def test_empty_index():
+    assert UnavailabilityIndex([]).unavailable_on('2024-01-01') == set()
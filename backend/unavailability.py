@@ -0,0 +1,49 @@
+import bisect
+from collections import Counter
+from datetime import date as Date, timedelta
+
+from storage import storage
+
+
+# In-memory interval index over holiday periods
+class UnavailabilityIndex:
+    # The period boundaries split the timeline into segments over which the set of absent
+    # employees does not change, so looking up a day is a binary search over the boundaries
+    def __init__(self, periods):
+        events = {}
+        for period in periods:
+            start = to_date(period['Start Date'])
+            end = to_date(period['End Date'])
+            if end < start:
+                continue
+            events.setdefault(start, []).append((period['Employee ID'], 1))
+            # Periods are inclusive of the end date, so the employee returns the day after
+            events.setdefault(end + timedelta(days=1), []).append((period['Employee ID'], -1))
+
+        self.boundaries = sorted(events)
+        self.segments = []
+        active = Counter()
+        for boundary in self.boundaries:
+            for employee_id, delta in events[boundary]:
+                active[employee_id] += delta
+                if not active[employee_id]:
+                    del active[employee_id]
+            self.segments.append(frozenset(active))
+
+    # Get the set of employee ids that are unavailable on the date
+    def unavailable_on(self, date):
+        i = bisect.bisect_right(self.boundaries, to_date(date)) - 1
+        if i < 0:
+            return frozenset()
+        return self.segments[i]
+
+
+# Fetch the holiday records for the date range once and index them
+def load_unavailability_index(start_date, end_date):
+    return UnavailabilityIndex(storage.get_unavailability_for_range(start_date, end_date))
+
+
+def to_date(value):
+    if isinstance(value, Date):
+        return value
+    return Date.fromisoformat(value)